@@ -0,0 +1,426 @@
+# Local stand-ins for the services used by oktaVboutSync.py and scraper.py, so both can be benchmarked without live Okta, VBout, SMTP and coinmarketcap.com.
+#
+# - mockApiServer:    Okta (/api/v1/...) and VBout (/1/emailmarketing/...) APIs on one port, with a generated tenant of a configurable size,
+#                     paging, X-Rate-Limit-* headers, a configurable latency per request and a share of requests answered with HTTP 429
+# - smtpSink:         SMTP server that accepts (and keeps) every message, with or without AUTH
+# - coinMarketCapServer: static copy of the CoinMarketCap table pages (?page=N, rendered rows and the embedded __NEXT_DATA__ JSON state)
+#                     and the listing endpoint used by the feed mode, for a configurable number of coins
+#
+# The runner (runBenchmarks.py) starts them in background threads. They can also be started on their own, e.g. to point a manually edited config.ini at them:
+#    python mockServers.py --users 10000 --latency 0.05
+
+import http.server, socketserver
+import argparse, json, random, re, threading, time
+import urllib.parse
+
+class requestCounter():
+    '''
+    Thread safe count of the requests received, per service and endpoint
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def add(self, name):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def total(self, prefix=''):
+        with self.lock:
+            return sum(count for name, count in self.counts.items() if name.startswith(prefix))
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+
+class mockTenant():
+    '''
+    Generated Okta tenant and matching VBout list. Users are spread over "groups" groups (every 5th user is also in the next group and every 50th user is deprovisioned).
+    The VBout list starts with "vboutOverlap" of the active users already in it (2% of them with an outdated last name) plus 5% stale contacts,
+    so a sync run has adds, updates and deletes to send. "changedShare" of the users are returned as updated by the incremental sync search
+    '''
+    LIST_FIELDS = {'101': 'First Name', '102': 'Last Name', '103': 'Email Address', '104': 'Customer', '105': 'Activated'}
+
+    def __init__(self, users=1000, groups=10, vboutOverlap=0.9, changedShare=0.01, listName='benchmarkList', seed=1):
+        randomGenerator = random.Random(seed)
+        self.lock = threading.Lock()
+        self.listName = listName
+        self.groups = [{'id': '00g' + str(n).zfill(17), 'profile': {'name': 'benchmarkGroup' + str(n)}} for n in range(groups)]
+        self.users = []
+        self.groupMembers = {group['id']: [] for group in self.groups}
+        for n in range(users):
+            user = {'id': '00u' + str(n).zfill(17), 'status': 'DEPROVISIONED' if n % 50 == 49 else 'ACTIVE', 'created': '2023-01-01T10:00:00.000Z', 'lastUpdated': '2023-05-01T10:00:00.000Z',
+                    'profile': {'login': 'user' + str(n) + '@example.com', 'email': 'user' + str(n) + '@example.com', 'firstName': 'First' + str(n), 'lastName': 'Last' + str(n)}}
+            self.users.append(user)
+            userGroups = [self.groups[n % groups]] + ([self.groups[(n + 1) % groups]] if n % 5 == 4 and groups > 1 else [])
+            user['groups'] = userGroups
+            for group in userGroups:
+                self.groupMembers[group['id']].append(user)
+        self.usersById = {user['id']: user for user in self.users}
+        self.changedUsers = randomGenerator.sample(self.users, int(users * changedShare))
+
+        self.contacts = {} # contact id -> contact
+        for user in self.users:
+            if user['status'] == 'ACTIVE' and randomGenerator.random() < vboutOverlap:
+                groupNames = ','.join(sorted(group['profile']['name'] for group in user['groups']))
+                lastName = user['profile']['lastName'] + ('-old' if randomGenerator.random() < 0.02 else '')
+                self.addContact(user['profile']['login'], {'101': user['profile']['firstName'], '102': lastName, '103': user['profile']['login'], '104': groupNames, '105': '2023-01-01'})
+        for n in range(int(users * 0.05)):
+            self.addContact('stale' + str(n) + '@example.com', {'101': 'Stale', '102': str(n), '103': 'stale' + str(n) + '@example.com', '104': 'benchmarkGroup0', '105': '2022-01-01'})
+
+    def addContact(self, email, fields):
+        with self.lock:
+            contactId = str(len(self.contacts) + 100000)
+            while contactId in self.contacts:
+                contactId = str(int(contactId) + 1)
+            self.contacts[contactId] = {'id': contactId, 'email': email, 'status': 'active', 'fields': fields}
+
+def pageOf(items, params, limitName='limit', defaultLimit=200):
+    '''
+    Returns (items on the page, index of the next page or None) for Okta style cursor paging (limit & after)
+    '''
+    limit = int(params.get(limitName, [defaultLimit])[0])
+    start = int(params.get('after', [0])[0])
+    return items[start:start + limit], (start + limit if start + limit < len(items) else None)
+
+class mockApiHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves the Okta and VBout endpoints used by oktaVboutSync.py from the server's tenant. Keep-alive (HTTP/1.1) is supported, so connection reuse shows in the results
+    '''
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass # Keep the benchmark output readable
+
+    def sendJSON(self, body, status=200, headers=None):
+        content = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        self.handle_request()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        self.handle_request()
+
+    def handle_request(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        path = re.sub(r'/+', '/', url.path).rstrip('/')
+        params = urllib.parse.parse_qs(url.query)
+        if server.latency:
+            time.sleep(server.latency)
+        if path.startswith('/api/v1/'):
+            self.handleOkta(path, params)
+        elif path.startswith('/1/emailmarketing/'):
+            self.handleVbout(path.split('/')[-1], params)
+        else:
+            self.sendJSON({'errorSummary': 'Not found: ' + path}, 404)
+
+    def rateLimitHeaders(self, endpoint):
+        '''
+        Per endpoint rate limit window of one minute, as Okta reports it. Returns (headers, whether the request is over the limit)
+        '''
+        server = self.server
+        window = int(time.time() // 60)
+        with server.rateLock:
+            used = server.rateUsage.get((endpoint, window), 0) + 1
+            server.rateUsage[(endpoint, window)] = used
+        reset = (window + 1) * 60
+        overLimit = server.rateLimit and used > server.rateLimit
+        if overLimit or (server.throttleShare and server.random.random() < server.throttleShare):
+            return {'X-Rate-Limit-Limit': str(server.rateLimit or 6000), 'X-Rate-Limit-Remaining': '0', 'X-Rate-Limit-Reset': str(int(time.time()) + 1 if not overLimit else reset)}, True
+        return {'X-Rate-Limit-Limit': str(server.rateLimit or 6000), 'X-Rate-Limit-Remaining': str(max((server.rateLimit or 6000) - used, 0)), 'X-Rate-Limit-Reset': str(reset)}, False
+
+    def linkHeader(self, path, params, nextIndex):
+        links = ['<http://{}:{}{}?{}>; rel="self"'.format(self.server.server_address[0], self.server.server_address[1], path, urllib.parse.urlencode(params, doseq=True))]
+        if nextIndex is not None:
+            nextParams = dict(params, after=[str(nextIndex)])
+            links.append('<http://{}:{}{}?{}>; rel="next"'.format(self.server.server_address[0], self.server.server_address[1], path, urllib.parse.urlencode(nextParams, doseq=True)))
+        return ', '.join(links)
+
+    def handleOkta(self, path, params):
+        tenant = self.server.tenant
+        endpoint = re.sub(r'/[0-9a-zA-Z]{20}(?=/|$)', '/{id}', path)
+        self.server.counter.add('okta ' + endpoint)
+        headers, throttled = self.rateLimitHeaders(endpoint)
+        if throttled:
+            self.server.counter.add('okta 429')
+            self.sendJSON({'errorCode': 'E0000047', 'errorSummary': 'API call exceeded rate limit due to too many requests.'}, 429, headers)
+            return
+
+        parts = path.split('/')[3:] # e.g. ['groups', '00g...', 'users']
+        if parts == ['groups']:
+            items = tenant.groups
+        elif len(parts) == 3 and parts[0] == 'groups' and parts[2] == 'users' and parts[1] in tenant.groupMembers:
+            items = tenant.groupMembers[parts[1]]
+        elif parts == ['users']:
+            items = tenant.changedUsers if 'search' in params else tenant.users
+        elif parts == ['logs']:
+            items = [] # No membership changes. Okta always returns a next link for polling the System Log
+            headers['Link'] = self.linkHeader(path, params, 0)
+            self.sendJSON(items, 200, headers)
+            return
+        elif len(parts) == 2 and parts[0] == 'users' and parts[1] in tenant.usersById:
+            self.sendJSON(self.oktaUser(tenant.usersById[parts[1]]), 200, headers)
+            return
+        elif len(parts) == 3 and parts[0] == 'users' and parts[2] == 'groups' and parts[1] in tenant.usersById:
+            items = tenant.usersById[parts[1]]['groups']
+        else:
+            self.sendJSON({'errorCode': 'E0000007', 'errorSummary': 'Not found: Resource not found: ' + path}, 404, headers)
+            return
+
+        pageItems, nextIndex = pageOf(items, params)
+        headers['Link'] = self.linkHeader(path, params, nextIndex)
+        self.sendJSON([self.oktaUser(item) if 'groups' in item else item for item in pageItems], 200, headers)
+
+    def oktaUser(self, user):
+        return {key: value for key, value in user.items() if key != 'groups'}
+
+    def handleVbout(self, endpoint, params):
+        tenant = self.server.tenant
+        self.server.counter.add('vbout ' + endpoint)
+        value = lambda name: params.get(name, [''])[0]
+        if endpoint == 'getlists.json':
+            lists = [{'id': str(2000 + n), 'name': 'otherList' + str(n), 'fields': {}} for n in range(3)] + [{'id': '1000', 'name': tenant.listName, 'fields': mockTenant.LIST_FIELDS}]
+            self.sendVboutItems('lists', lists, params)
+        elif endpoint == 'getcontacts.json':
+            with tenant.lock:
+                contacts = list(tenant.contacts.values()) if value('listid') == '1000' else []
+            self.sendVboutItems('contacts', contacts, params)
+        elif endpoint in ('addcontact.json', 'updatecontact.json', 'deletecontact.json'):
+            fields = {re.sub(r'\D', '', name): values[0] for name, values in params.items() if name.startswith('fields[')}
+            with tenant.lock:
+                contact = tenant.contacts.get(value('id'))
+                if endpoint == 'updatecontact.json' and contact:
+                    contact['fields'].update(fields)
+                elif endpoint == 'deletecontact.json':
+                    tenant.contacts.pop(value('id'), None)
+            if endpoint == 'addcontact.json':
+                tenant.addContact(value('email'), fields)
+            elif contact is None:
+                self.sendJSON({'response': {'header': {'status': 'error'}, 'data': {'errorCode': 1001, 'errorMessage': 'Contact not found'}}})
+                return
+            self.sendJSON({'response': {'header': {'status': 'ok'}, 'data': {'item': 'success'}}})
+        else:
+            self.sendJSON({'response': {'header': {'status': 'error'}, 'data': {'errorMessage': 'Unknown method ' + endpoint}}})
+
+    def sendVboutItems(self, collection, items, params):
+        limit = int(params.get('limit', ['25'])[0])
+        page = int(params.get('page', ['1'])[0])
+        pageItems = items[(page - 1) * limit:page * limit]
+        self.sendJSON({'response': {'header': {'status': 'ok'}, 'data': {collection: {'count': len(items), 'items': pageItems}}}})
+
+class mockApiServer(http.server.ThreadingHTTPServer):
+    '''
+    Okta & VBout mock. latency is added to every request (seconds), throttleShare of the Okta requests get a 429 (with a reset one second later)
+    and rateLimit, if set, is the number of requests per endpoint per minute before every request gets a 429, as with a real Okta org
+    '''
+    daemon_threads = True
+
+    def __init__(self, tenant, latency=0.0, throttleShare=0.0, rateLimit=0, port=0, seed=1):
+        super().__init__(('127.0.0.1', port), mockApiHandler)
+        self.tenant = tenant
+        self.latency = latency
+        self.throttleShare = throttleShare
+        self.rateLimit = rateLimit
+        self.random = random.Random(seed)
+        self.rateLock = threading.Lock()
+        self.rateUsage = {}
+        self.counter = requestCounter()
+
+class smtpSinkHandler(socketserver.StreamRequestHandler):
+    '''
+    Minimal SMTP dialogue (EHLO/HELO, AUTH, MAIL, RCPT, DATA, RSET, NOOP, QUIT). Every message received is appended to the server's "messages"
+    '''
+    def reply(self, line):
+        self.wfile.write((line + '\r\n').encode('utf-8'))
+
+    def handle(self):
+        self.reply('220 localhost benchmark SMTP sink')
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode('utf-8', 'replace').strip()
+            verb = command.split(' ')[0].upper()
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250-AUTH PLAIN LOGIN')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'AUTH':
+                self.reply('235 Authentication successful') # Any credentials are accepted
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip('<> '), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip('<> '))
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                lines = []
+                while True:
+                    dataLine = self.rfile.readline()
+                    if not dataLine or dataLine in (b'.\r\n', b'.\n'):
+                        break
+                    lines.append(dataLine[1:] if dataLine.startswith(b'..') else dataLine)
+                with self.server.lock:
+                    self.server.messages.append({'from': sender, 'to': recipients, 'data': b''.join(lines).decode('utf-8', 'replace')})
+                self.reply('250 OK: queued')
+            elif verb in ('RSET', 'NOOP'):
+                sender, recipients = (None, []) if verb == 'RSET' else (sender, recipients)
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+class smtpSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), smtpSinkHandler)
+        self.lock = threading.Lock()
+        self.messages = []
+
+def generateCoins(count, seed=1):
+    '''
+    Returns "count" coins in the flattened form of the page state (dotted keys, see parseEmbeddedListing() in scraper.py), ranked by market cap
+    '''
+    randomGenerator = random.Random(seed)
+    coins = []
+    marketCap = 5e11
+    for rank in range(1, count + 1):
+        price = 10 ** randomGenerator.uniform(-6, 4.5)
+        marketCap = marketCap * randomGenerator.uniform(0.9, 0.999)
+        volume = marketCap * randomGenerator.uniform(0.01, 0.1)
+        coins.append({'id': rank * 7, 'name': 'Coin ' + str(rank), 'symbol': 'C' + str(rank), 'slug': 'coin-' + str(rank), 'cmcRank': rank, 'circulatingSupply': round(marketCap / price),
+                      'quote.USD.price': price, 'quote.USD.volume24h': volume, 'quote.USD.marketCap': marketCap, 'quote.USD.percentChange1h': randomGenerator.uniform(-2, 2),
+                      'quote.USD.percentChange24h': randomGenerator.uniform(-8, 8), 'quote.USD.percentChange7d': randomGenerator.uniform(-20, 20)})
+    return coins
+
+class coinMarketCapHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Serves /?page=N as a static copy of the CoinMarketCap table page (rows rendered in the table and the listing in the __NEXT_DATA__ JSON state, in the compressed keysArr form),
+    and /data-api/v3/cryptocurrency/listing?start=&limit= as the listing endpoint
+    '''
+    protocol_version = 'HTTP/1.1'
+    KEYS = ['id', 'name', 'symbol', 'slug', 'cmcRank', 'circulatingSupply', 'quote.USD.price', 'quote.USD.volume24h', 'quote.USD.marketCap',
+            'quote.USD.percentChange1h', 'quote.USD.percentChange24h', 'quote.USD.percentChange7d']
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, content, contentType, status=200):
+        content = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', contentType)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        server = self.server
+        url = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(url.query)
+        if server.latency:
+            time.sleep(server.latency)
+        if url.path.rstrip('/') == '/data-api/v3/cryptocurrency/listing':
+            server.counter.add('cmc listing')
+            start = int(params.get('start', ['1'])[0])
+            limit = int(params.get('limit', ['100'])[0])
+            self.send(json.dumps({'data': {'cryptoCurrencyList': [self.apiCoin(coin) for coin in server.coins[start - 1:start - 1 + limit]], 'totalCount': str(len(server.coins))}}), 'application/json')
+        elif url.path in ('', '/'):
+            server.counter.add('cmc page')
+            page = int(params.get('page', ['1'])[0])
+            self.send(self.renderPage(server.coins[(page - 1) * server.rowsPerPage:page * server.rowsPerPage]), 'text/html; charset=utf-8')
+        else:
+            server.counter.add('cmc other')
+            self.send('Not found', 'text/plain', 404)
+
+    def apiCoin(self, coin):
+        quote = {'name': 'USD'}
+        quote.update({key[len('quote.USD.'):]: value for key, value in coin.items() if key.startswith('quote.USD.')})
+        result = {key: value for key, value in coin.items() if not key.startswith('quote.')}
+        result['quotes'] = [quote]
+        return result
+
+    def renderChange(self, change):
+        '''
+        The table shows the direction of a change with an arrow only, e.g. <span class="icon-Caret-down"></span>3.36%
+        '''
+        return '<span class="icon-Caret-{}"></span>{:.2f}%'.format('down' if change < 0 else 'up', abs(change))
+
+    def renderPage(self, coins):
+        rows = []
+        for coin in coins:
+            price = coin['quote.USD.price']
+            cells = ['', str(coin['cmcRank']), '<p>{}</p><p>{}</p>'.format(coin['name'], coin['symbol']), '${:,.2f}'.format(price) if price >= 1 else '${:.8f}'.format(price)]
+            cells.extend(self.renderChange(coin['quote.USD.' + change]) for change in ('percentChange1h', 'percentChange24h', 'percentChange7d'))
+            cells.append('${:,.0f}'.format(coin['quote.USD.marketCap']))
+            cells.append('<p>${:,.0f}</p><p>{:,.0f} {}</p>'.format(coin['quote.USD.volume24h'], coin['quote.USD.volume24h'] / price, coin['symbol']))
+            cells.append('{:,.0f} {}'.format(coin['circulatingSupply'], coin['symbol']))
+            cells.extend(['', ''])
+            rows.append('<tr>' + ''.join('<td>' + cell + '</td>' for cell in cells) + '</tr>')
+        state = {'cryptocurrency': {'listingLatest': {'page': 1, 'sort': '', 'data': [{'keysArr': self.KEYS, 'excludeProps': []}] + [[coin[key] for key in self.KEYS] for coin in coins]}}}
+        nextData = json.dumps({'props': {'initialState': json.dumps(state), 'pageProps': {}}, 'page': '/', 'query': {}}).replace('</', '<\\/')
+        return ('<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8"><title>Cryptocurrency Prices, Charts And Market Capitalizations | CoinMarketCap</title></head>\n<body>\n'
+                '<div id="__next"><div class="cmc-body-wrapper"><table class="cmc-table"><thead><tr><th></th><th>#</th><th>Name</th><th>Price</th><th>1h %</th><th>24h %</th><th>7d %</th>'
+                '<th>Market Cap</th><th>Volume(24h)</th><th>Circulating Supply</th><th>Last 7 Days</th><th></th></tr></thead><tbody>' + ''.join(rows) + '</tbody></table></div></div>\n'
+                '<script id="__NEXT_DATA__" type="application/json">' + nextData + '</script>\n</body>\n</html>\n')
+
+class coinMarketCapServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, coins, rowsPerPage=100, latency=0.0, port=0):
+        super().__init__(('127.0.0.1', port), coinMarketCapHandler)
+        self.coins = generateCoins(coins) if isinstance(coins, int) else coins
+        self.rowsPerPage = rowsPerPage
+        self.latency = latency
+        self.counter = requestCounter()
+
+def startInBackground(server):
+    '''
+    Serves requests in a daemon thread and returns the server, whose port is server.server_address[1]
+    '''
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Start the mock Okta/VBout API, the SMTP sink and the CoinMarketCap pages until Ctrl+C')
+    parser.add_argument('--users', type=int, default=1000, help='Okta users in the tenant')
+    parser.add_argument('--groups', type=int, default=10, help='Okta groups the users are spread over')
+    parser.add_argument('--coins', type=int, default=500, help='Coins listed on the CoinMarketCap pages')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds added to every HTTP request')
+    parser.add_argument('--throttle', type=float, default=0.0, help='Share of the Okta requests answered with HTTP 429')
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--smtp-port', type=int, default=8025)
+    parser.add_argument('--page-port', type=int, default=8082)
+    arguments = parser.parse_args()
+
+    apiServer = startInBackground(mockApiServer(mockTenant(users=arguments.users, groups=arguments.groups), latency=arguments.latency, throttleShare=arguments.throttle, port=arguments.api_port))
+    sink = startInBackground(smtpSink(port=arguments.smtp_port))
+    pageServer = startInBackground(coinMarketCapServer(arguments.coins, latency=arguments.latency, port=arguments.page_port))
+    print('Okta:  oktaUrl = http://127.0.0.1:{}/'.format(apiServer.server_address[1]))
+    print('VBout: vboutUrl = http://127.0.0.1:{}/1/  (vboutListToSync = {})'.format(apiServer.server_address[1], apiServer.tenant.listName))
+    print('SMTP:  smtpHost = 127.0.0.1, smtpPort = {}, smtpSsl = false'.format(sink.server_address[1]))
+    print('CoinMarketCap: WEBSITE_URL: http://127.0.0.1:{}/'.format(pageServer.server_address[1]))
+    print('Press Ctrl+C to stop')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
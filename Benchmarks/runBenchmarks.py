@@ -0,0 +1,167 @@
+# Offline benchmarks of oktaVboutSync.py and scraper.py against the local stand-ins of mockServers.py.
+#
+# Each benchmark starts the mock servers in this process, writes a config pointing the script at them into a temporary folder, runs the script there
+# as a separate process and records its end-to-end time, peak memory (maximum resident set size of the script's process, from os.wait4) and the number of
+# requests the mock servers received. Results are printed and appended to a JSON Lines file (one record per benchmark, with the git commit), so runs
+# before and after a change can be compared.
+#
+# Run with:    python runBenchmarks.py                                   (Okta sync with 1,000 and 10,000 users, scraper feed mode with 500 and 5,000 coins)
+#              python runBenchmarks.py --users 1000,50000 --latency 0.05 --throttle 0.02
+#              python runBenchmarks.py --only scraper --browser          (also scrape the pages with Chrome, needs Chrome and the ChromeDriver of scraper's config.ini)
+
+import argparse, configparser, csv, json, os, shutil, subprocess, sys, tempfile, time
+from datetime import datetime, timezone
+import mockServers
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SYNC_SCRIPT = os.path.join(ROOT, 'Okta-Vbout Sync', 'oktaVboutSync.py')
+SCRAPER_SCRIPT = os.path.join(ROOT, 'CoinMarketCap-Scraper', 'scraper.py')
+
+def runScript(command, workDir, env=None):
+    '''
+    Runs the command in workDir (output to run.log there) and returns its wall time, exit code and peak memory in MB (None where os.wait4 is not available, i.e. on Windows)
+    '''
+    with open(os.path.join(workDir, 'run.log'), 'w', encoding='utf-8') as logFile:
+        started = time.perf_counter()
+        process = subprocess.Popen(command, cwd=workDir, env=env, stdout=logFile, stderr=subprocess.STDOUT)
+        if hasattr(os, 'wait4'):
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peakMemory = usage.ru_maxrss / (1048576 if sys.platform == 'darwin' else 1024) # ru_maxrss is in bytes on macOS, in KB on Linux
+        else:
+            process.wait()
+            peakMemory = None
+        seconds = time.perf_counter() - started
+    return {'seconds': round(seconds, 3), 'exitCode': process.returncode, 'peakMemoryMB': round(peakMemory, 1) if peakMemory is not None else None}
+
+def writeSyncConfig(workDir, apiPort, smtpPort, tenant, oktaPageSize=200, vboutPageSize=1000):
+    config = configparser.RawConfigParser()
+    config.optionxform = str # Keep the camelCase keys
+    config['general'] = {
+        'oktaApiKey': 'benchmark', 'oktaUrl': 'http://127.0.0.1:{}/'.format(apiPort), 'oktaLimit': str(oktaPageSize), 'excludedGroups': 'excludedBenchmarkGroup',
+        'oktaConcurrency': '8', 'oktaMaxRetries': '5', 'oktaRateLimitReserve': '2', 'syncMode': 'incremental', 'checkpointFile': 'checkpoint.json',
+        'vboutApiKey': 'benchmark', 'vboutUrl': 'http://127.0.0.1:{}/1/'.format(apiPort), 'vboutListToSync': tenant.listName,
+        'vboutPageSize': str(vboutPageSize), 'vboutPageConcurrency': '4', 'vboutWriteWorkers': '4', 'planFile': 'plan.jsonl', 'cacheFile': '',
+        'logLevel': 'INFO', 'logFormat': 'json', 'metricsFile': 'metrics.json', 'metricsFormat': 'json',
+        'smtpPort': str(smtpPort), 'smtpHost': '127.0.0.1', 'smtpSsl': 'false', 'smtpUser': 'sync@example.com', 'smtpPassword': 'benchmark', 'smtpAppPassword': 'benchmark',
+        'recipients': 'admin@example.com'}
+    with open(os.path.join(workDir, 'config.ini'), 'w', encoding='utf-8') as configFile:
+        config.write(configFile)
+
+def benchmarkSync(users, arguments):
+    '''
+    Runs a full sync of a new tenant with "users" users, then an incremental sync (from the checkpoint of the first run) against the synced list
+    '''
+    tenant = mockServers.mockTenant(users=users, groups=max(users // 500, 2))
+    apiServer = mockServers.startInBackground(mockServers.mockApiServer(tenant, latency=arguments.latency, throttleShare=arguments.throttle, rateLimit=arguments.rate_limit))
+    sink = mockServers.startInBackground(mockServers.smtpSink())
+    workDir = tempfile.mkdtemp(prefix='oktaVboutSync-benchmark-')
+    os.makedirs(os.path.join(workDir, 'logs'))
+    writeSyncConfig(workDir, apiServer.server_address[1], sink.server_address[1], tenant, arguments.okta_page_size, arguments.vbout_page_size)
+
+    results = []
+    try:
+        for mode in ('full', 'incremental'):
+            apiServer.counter.reset()
+            emailsBefore = len(sink.messages)
+            result = runScript([sys.executable, SYNC_SCRIPT], workDir)
+            activeUsers = {user['profile']['login'] for user in tenant.users if user['status'] == 'ACTIVE'}
+            with tenant.lock:
+                contacts = {contact['email'] for contact in tenant.contacts.values()}
+            result.update({'benchmark': 'oktaVboutSync ' + mode, 'size': users, 'oktaRequests': apiServer.counter.total('okta /'), 'throttled': apiServer.counter.total('okta 429'),
+                           'vboutRequests': apiServer.counter.total('vbout '), 'emails': len(sink.messages) - emailsBefore, 'inSync': contacts == activeUsers})
+            try:
+                with open(os.path.join(workDir, 'metrics.json'), encoding='utf-8') as metricsFile:
+                    result['phasesSeconds'] = {name: round(seconds, 3) for name, seconds in json.load(metricsFile)['phasesSeconds'].items()}
+            except (OSError, ValueError, KeyError):
+                pass
+            results.append(result)
+    finally:
+        apiServer.shutdown()
+        sink.shutdown()
+        if not arguments.keep:
+            shutil.rmtree(workDir, ignore_errors=True)
+    return results
+
+def benchmarkScraper(coins, mode, arguments):
+    '''
+    Scrapes "coins" rows (100 per page, as many pages as needed) from the static CoinMarketCap pages: mode "feed-page" and "feed-api" without a browser (FETCH_MODE feed),
+    "browser" with the multi-page Chrome pool
+    '''
+    pageServer = mockServers.startInBackground(mockServers.coinMarketCapServer(coins, latency=arguments.latency))
+    workDir = tempfile.mkdtemp(prefix='scraper-benchmark-')
+    baseUrl = 'http://127.0.0.1:{}/'.format(pageServer.server_address[1])
+
+    config = configparser.RawConfigParser()
+    config.read(os.path.join(ROOT, 'CoinMarketCap-Scraper', 'config.ini'))
+    config.set('config', 'CHROMEDRIVER_PATH', arguments.chromedriver or os.path.join(ROOT, 'CoinMarketCap-Scraper', config.get('config', 'CHROMEDRIVER_PATH')))
+    overrides = {'WEBSITE_URL': baseUrl, 'FEED_API_URL': baseUrl + 'data-api/v3/cryptocurrency/listing', 'FEED_FIXTURE_PATH': '', 'OUTPUTFOLDER_PATH': './output',
+                 'MULTI_PAGE_MODE': 'true', 'TOTAL_ROWS': str(coins), 'TOTAL_TABLE_ROWS_PER_PAGE': '100', 'KEEP_BROWSERS_WARM': 'false', 'DAEMON_MODE': 'false',
+                 'NORMALIZED_OUTPUT': 'false', 'LEAN_LOAD': 'false', 'FEED_SCREENSHOT': 'false',
+                 'FETCH_MODE': 'browser' if mode == 'browser' else 'feed', 'FEED_SOURCE': 'api' if mode == 'feed-api' else 'page'}
+    for name, value in overrides.items():
+        config.set('config', name, value)
+    configPath = os.path.join(workDir, 'config.ini')
+    with open(configPath, 'w', encoding='utf-8') as configFile:
+        config.write(configFile)
+
+    try:
+        result = runScript([sys.executable, SCRAPER_SCRIPT], workDir, env=dict(os.environ, SCRAPER_CONFIG=configPath))
+        try:
+            with open(os.path.join(workDir, 'output', 'table_data.csv'), newline='') as csvFile:
+                rows = sum(1 for row_data in csv.reader(csvFile) if len(row_data) > 1 and row_data[1].isdigit())
+        except OSError:
+            rows = 0
+        result.update({'benchmark': 'scraper ' + mode, 'size': coins, 'requests': pageServer.counter.total(), 'rows': rows})
+    finally:
+        pageServer.shutdown()
+        if not arguments.keep:
+            shutil.rmtree(workDir, ignore_errors=True)
+    return [result]
+
+def gitCommit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark oktaVboutSync.py and scraper.py against local mock servers')
+    parser.add_argument('--only', choices=('sync', 'scraper'), help='Run the benchmarks of one script only')
+    parser.add_argument('--users', default='1000,10000', help='Comma separated Okta tenant sizes')
+    parser.add_argument('--coins', default='500,5000', help='Comma separated numbers of coins to scrape')
+    parser.add_argument('--latency', type=float, default=0.01, help='Seconds added to every request by the mock servers')
+    parser.add_argument('--throttle', type=float, default=0.0, help='Share of the Okta requests answered with HTTP 429')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Okta requests per endpoint per minute before every request gets a 429, 0 for no limit')
+    parser.add_argument('--okta-page-size', type=int, default=200, help='Okta users/groups per page (oktaLimit), 200 at most')
+    parser.add_argument('--vbout-page-size', type=int, default=1000, help='VBout contacts per page (vboutPageSize)')
+    parser.add_argument('--browser', action='store_true', help='Also run the scraper with Chrome (multi-page mode)')
+    parser.add_argument('--chromedriver', help='ChromeDriver to use instead of the CHROMEDRIVER_PATH of the scraper config')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark-results.jsonl'), help='JSON Lines file the results are appended to')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary folders (config, logs, output) of each run')
+    arguments = parser.parse_args()
+
+    results = []
+    if arguments.only != 'scraper':
+        for users in [int(size) for size in arguments.users.split(',')]:
+            results.extend(benchmarkSync(users, arguments))
+    if arguments.only != 'sync':
+        for coins in [int(size) for size in arguments.coins.split(',')]:
+            for mode in ('feed-page', 'feed-api') + (('browser',) if arguments.browser else ()):
+                results.extend(benchmarkScraper(coins, mode, arguments))
+
+    runInfo = {'time': datetime.now(timezone.utc).isoformat(), 'commit': gitCommit(), 'latency': arguments.latency, 'throttle': arguments.throttle,
+               'oktaPageSize': arguments.okta_page_size, 'vboutPageSize': arguments.vbout_page_size}
+    with open(arguments.output, 'a', encoding='utf-8') as resultsFile:
+        for result in results:
+            resultsFile.write(json.dumps(dict(runInfo, **result)) + '\n')
+
+    print('{:<30} {:>8} {:>9} {:>9} {:>10} {:>6}  {}'.format('benchmark', 'size', 'seconds', 'requests', 'peak MB', 'exit', 'checks'))
+    for result in results:
+        requests = result.get('requests', result.get('oktaRequests', 0) + result.get('vboutRequests', 0))
+        if 'inSync' in result:
+            checks = 'in sync: {}, 429s: {}, emails: {}'.format(result['inSync'], result['throttled'], result['emails'])
+        else:
+            checks = 'rows: {}'.format(result['rows'])
+        print('{:<30} {:>8} {:>9.2f} {:>9} {:>10} {:>6}  {}'.format(result['benchmark'], result['size'], result['seconds'], requests, result['peakMemoryMB'] if result['peakMemoryMB'] is not None else '-', result['exitCode'], checks))
+    print('Results appended to ' + arguments.output)
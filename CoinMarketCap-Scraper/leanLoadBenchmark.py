@@ -0,0 +1,63 @@
+# This script compares how long CoinMarketCap takes to load with and without the lean-load mode of scraper.py.
+#
+# Each run starts a fresh Chrome (so nothing is served from the browser cache), opens WEBSITE_URL and measures the time until FIRST_LOAD_XPATH is found,
+# and the time until SCROLL_TO_ELEMENT is found, together with the number of requests and bytes the page downloaded by then.
+# Runs alternate between the two modes, so changes in network speed affect both the same way. Uses the settings of config.ini (BLOCKED_URL_PATTERNS, BLOCK_IMAGES, CONSENT_COOKIES).
+#
+# Run with:    python leanLoadBenchmark.py [number of runs per mode, default 5]
+
+import statistics, sys, time
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+import scraper
+
+# Requests and bytes downloaded so far, from the Resource Timing API (transferSize is 0 for blocked requests)
+RESOURCES_SCRIPT = """
+var entries = performance.getEntriesByType('resource');
+var bytes = 0;
+for (var i = 0; i < entries.length; i++) bytes += entries[i].transferSize || 0;
+return [entries.length, bytes];
+"""
+
+def measureLoad(leanLoad):
+    """
+    Returns (seconds to FIRST_LOAD_XPATH, seconds to SCROLL_TO_ELEMENT, requests, bytes) for one page load in a new Chrome
+    """
+    browser = scraper.startDriver(leanLoad=leanLoad)
+    try:
+        browser.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': 'performance.setResourceTimingBufferSize(10000);'}) # The default buffer keeps 250 entries only
+        start = time.perf_counter()
+        browser.get(scraper.WEBSITE_URL)
+        WebDriverWait(browser, scraper.TIMEOUT, poll_frequency=scraper.POLLING_FREQUENCY).until( EC.presence_of_element_located((By.XPATH, scraper.FIRST_LOAD_XPATH)) )
+        firstLoad = time.perf_counter() - start
+        WebDriverWait(browser, scraper.TIMEOUT, poll_frequency=scraper.POLLING_FREQUENCY).until( EC.presence_of_element_located((By.XPATH, scraper.SCROLL_TO_ELEMENT)) )
+        tableLoad = time.perf_counter() - start
+        requestCount, byteCount = browser.execute_script(RESOURCES_SCRIPT)
+        return firstLoad, tableLoad, requestCount, byteCount
+    finally:
+        browser.quit()
+
+if __name__ == "__main__":
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    results = {False: [], True: []}
+    for run in range(runs):
+        for leanLoad in (False, True):
+            try:
+                result = measureLoad(leanLoad)
+                results[leanLoad].append(result)
+                print('Run {} {:<8} FIRST_LOAD_XPATH {:6.2f}s  table {:6.2f}s  {:4d} requests  {:8.0f} kB'.format(run + 1, 'lean' if leanLoad else 'full', result[0], result[1], result[2], result[3] / 1024))
+            except Exception as e:
+                print(" * ERROR - Run {} ({}) failed".format(run + 1, 'lean' if leanLoad else 'full'))
+                print(e)
+
+    print('\nMedian over {} runs:'.format(runs))
+    for leanLoad in (False, True):
+        if results[leanLoad]:
+            columns = list(zip(*results[leanLoad]))
+            print('{:<5} FIRST_LOAD_XPATH {:6.2f}s  table {:6.2f}s  {:6.0f} requests  {:8.0f} kB'.format('lean' if leanLoad else 'full', statistics.median(columns[0]), statistics.median(columns[1]),
+                                                                                                      statistics.median(columns[2]), statistics.median(columns[3]) / 1024))
+    if results[False] and results[True]:
+        full = statistics.median([result[0] for result in results[False]])
+        lean = statistics.median([result[0] for result in results[True]])
+        print('Lean-load mode reaches FIRST_LOAD_XPATH {:.0%} faster'.format(1 - lean / full) if full else '')
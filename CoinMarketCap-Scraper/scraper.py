@@ -30,6 +30,18 @@
 
 import configparser
 import os, platform, csv, shutil
+import math, queue, socket, subprocess, time
+import io, json, re
+from datetime import datetime, timezone
+import requests
+try: # pyarrow is only needed when NORMALIZED_OUTPUT is enabled
+    import pyarrow
+    import pyarrow.parquet
+    import pyarrow.ipc
+except ImportError:
+    pyarrow = None
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from PIL import Image
 from selenium import webdriver
 from selenium.webdriver.chrome.service import Service
@@ -41,7 +53,7 @@ from selenium.webdriver.support import expected_conditions as EC
 
 # Get config from config.ini
 config = configparser.RawConfigParser() # RawConfigParser sets interpolation to none so any % characters in the URLs can work
-config.read(os.path.join(os.path.dirname(os.path.abspath(__file__)),'config.ini'))
+config.read(os.environ.get('SCRAPER_CONFIG') or os.path.join(os.path.dirname(os.path.abspath(__file__)),'config.ini')) # SCRAPER_CONFIG can point to another config file, e.g. the one written by the benchmarks
 CHROMEDRIVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), config.get('config','CHROMEDRIVER_PATH'))
 TIMEOUT = config.getint('config','TIMEOUT') # Maximum time to wait for the dashboard to load
 POLLING_FREQUENCY = config.getfloat('config','POLLING_FREQUENCY') # Frequency at which the scrpt will check the dashboard DOM for html elements to appear/disappear
@@ -49,6 +61,9 @@ OUTPUTFOLDER_PATH = config.get('config','OUTPUTFOLDER_PATH') # Path to the direc
 BROWSER_SIZE = config.get('config','BROWSER_SIZE')
 IMAGE_WIDTH = config.getint('config','IMAGE_WIDTH') # Width of the image to be saved
 IMAGE_HEIGHT = config.getint('config','IMAGE_HEIGHT') # Height of the image to be saved
+SCREENSHOT_CROP = config.get('config', 'SCREENSHOT_CROP', fallback='page') # "page" captures the browser window, "table" only the SCROLL_TO_ELEMENT element
+WEBP_QUALITY = config.getint('config', 'WEBP_QUALITY', fallback=80) # 0-100, lower gives smaller files
+WEBP_METHOD = config.getint('config', 'WEBP_METHOD', fallback=4) # 0 (fastest) to 6 (smallest file)
 TOTAL_TABLE_ROWS_PER_PAGE = config.getint('config','TOTAL_TABLE_ROWS_PER_PAGE')
 SCROLL_WHEN_INDEX = config.getint('config','SCROLL_WHEN_INDEX')
 WEBSITE_URL = config.get('config','WEBSITE_URL')
@@ -58,33 +73,299 @@ ADS_CONTAINER = config.get('config', 'ADS_CONTAINER')
 ADS_CONTAINER_CLOSE = config.get('config', 'ADS_CONTAINER_CLOSE')
 FIRST_LOAD_XPATH = config.get('config', 'FIRST_LOAD_XPATH') # Xpath that will be awaited before proceeding to the next step
 SCROLL_TO_ELEMENT = config.get('config','SCROLL_TO_ELEMENT') # Xpath of the main table to which Selenium will scroll down to
+MULTI_PAGE_MODE = config.getboolean('config', 'MULTI_PAGE_MODE', fallback=False) # Scrape TOTAL_ROWS rows over several pages (?page=N) with a pool of Chrome instances
+TOTAL_ROWS = config.getint('config', 'TOTAL_ROWS', fallback=TOTAL_TABLE_ROWS_PER_PAGE) # Number of rows to scrape in multi-page mode
+DRIVER_POOL_SIZE = config.getint('config', 'DRIVER_POOL_SIZE', fallback=4) # Number of Chrome instances loading pages in parallel in multi-page mode
+KEEP_BROWSERS_WARM = config.getboolean('config', 'KEEP_BROWSERS_WARM', fallback=False) # Leave the pool's Chrome instances running when the script exits and re-attach to them on the next run
+DEBUG_PORT_BASE = config.getint('config', 'DEBUG_PORT_BASE', fallback=9300) # Chrome instance n of the pool listens for remote debugging on DEBUG_PORT_BASE + n
+CHROME_BINARY_PATH = config.get('config', 'CHROME_BINARY_PATH', fallback='google-chrome') # Needed to start the warm Chrome instances outside of ChromeDriver
+FETCH_MODE = config.get('config', 'FETCH_MODE', fallback='browser') # "browser" scrapes the rendered table with Selenium, "feed" reads the same data as JSON without a browser
+FEED_SOURCE = config.get('config', 'FEED_SOURCE', fallback='page') # In feed mode, "page" parses the JSON state embedded in the page, "api" calls the listing endpoint the page uses
+FEED_API_URL = config.get('config', 'FEED_API_URL', fallback='https://api.coinmarketcap.com/data-api/v3/cryptocurrency/listing')
+FEED_FIXTURE_PATH = config.get('config', 'FEED_FIXTURE_PATH', fallback='') # Saved copy of the page to parse instead of downloading it, for checking the feed mode offline
+FEED_SCREENSHOT = config.getboolean('config', 'FEED_SCREENSHOT', fallback=True) # In feed mode, still start Chrome to take the screenshot
+NORMALIZED_OUTPUT = config.getboolean('config', 'NORMALIZED_OUTPUT', fallback=False) # Also append each snapshot, parsed into typed columns, to HISTORY_PATH
+HISTORY_PATH = config.get('config', 'HISTORY_PATH', fallback='./history') # Folder of the snapshot history, partitioned by date (date=YYYY-MM-DD). Keep it outside OUTPUTFOLDER_PATH, which is emptied on every run
+HISTORY_FORMAT = config.get('config', 'HISTORY_FORMAT', fallback='parquet') # "parquet" or "arrow" (Arrow IPC file)
+DAEMON_MODE = config.getboolean('config', 'DAEMON_MODE', fallback=False) # Keep Chrome and the page open and re-read the table every POLL_INTERVAL seconds, storing only the rows that changed
+POLL_INTERVAL = config.getfloat('config', 'POLL_INTERVAL', fallback=60) # Seconds between two reads of the table in daemon mode
+FULL_SNAPSHOT_EVERY = config.getint('config', 'FULL_SNAPSHOT_EVERY', fallback=60) # In daemon mode, store every row each N ticks and only the changed rows in between
+CHANGES_PATH = config.get('config', 'CHANGES_PATH', fallback='./changes') # Folder of the daemon's change logs, one JSON Lines file per day. Keep it outside OUTPUTFOLDER_PATH
+LEAN_LOAD = config.getboolean('config', 'LEAN_LOAD', fallback=False) # Block ads, trackers and images, pre-set the consent cookie and return from page loads once the DOM is ready
+BLOCKED_URL_PATTERNS = [pattern.strip() for pattern in config.get('config', 'BLOCKED_URL_PATTERNS', fallback='').split(',') if pattern.strip()] # URL patterns (* wildcard) Chrome never downloads in lean-load mode
+BLOCK_IMAGES = config.getboolean('config', 'BLOCK_IMAGES', fallback=True) # In lean-load mode, also skip every image (the screenshot then shows no logos or charts)
+CONSENT_COOKIES = [cookie.strip() for cookie in config.get('config', 'CONSENT_COOKIES', fallback='').split(',') if '=' in cookie] # name=value cookies set before the page is loaded in lean-load mode, so no consent banner is shown
+EXTRACT_MODE = config.get('config', 'EXTRACT_MODE', fallback='webdriver') # "webdriver" reads the table cell by cell, "js" reads all rendered rows with one JavaScript call per scroll window, "rank" scrolls one viewport at a time until every rank is collected
+if DAEMON_MODE and (MULTI_PAGE_MODE or FETCH_MODE == 'feed'): # The daemon only polls a single page in the browser, it would otherwise be skipped without notice
+    raise ValueError('DAEMON_MODE can not be combined with MULTI_PAGE_MODE or FETCH_MODE: feed, turn them off in config.ini')
 
-# Initialize Chrome
-options = webdriver.ChromeOptions()
-options.add_experimental_option('excludeSwitches', ['enable-logging']) # This will silence "USB Device not functioning" errors Chrome might return
-options.add_argument(BROWSER_SIZE)
-if (platform.system() != 'Windows'): # Hide Chrome browser if the script is run on a Linux server, which most porbably does not have a display
-    options.add_argument('headless') # 'headless' will keep Chrome browser hidden
-chrome_service = Service(CHROMEDRIVER_PATH)
-driver = webdriver.Chrome(service=chrome_service, options=options)
+# The table shows the direction of the 1h/24h/7d changes with an up/down arrow only, e.g. <span class="icon-Caret-down"></span>3.36%
+CARET_DOWN_SELECTOR = '[class*="icon-Caret-down"]'
+
+# Text of a table cell for the JavaScript extractors, with a "-" added to changes shown with a down arrow
+CELL_TEXT_SCRIPT = """
+function cellText(cell) {
+    var text = cell.innerText;
+    if (/%$/.test(text.trim()) && text.trim().charAt(0) !== '-' && cell.querySelector('""" + CARET_DOWN_SELECTOR + """')) return '-' + text.trim();
+    return text;
+}
+"""
+
+# Returns the rendered rows of the table whose rank (2nd column) is not in arguments[0] as arrays of cell texts, then scrolls the last rendered row into view so the next rows get rendered.
+# Rows that are not rendered yet (virtual scrolling) have fewer cells than the table header and are skipped
+EXTRACT_ROWS_SCRIPT = CELL_TEXT_SCRIPT + """
+var collected = arguments[0];
+var headerCount = document.querySelectorAll('.cmc-table thead th').length;
+var rows = document.querySelectorAll('.cmc-table tbody tr');
+var result = [];
+var lastRendered = null;
+for (var i = 0; i < rows.length; i++) {
+    var cells = rows[i].querySelectorAll('td');
+    if (cells.length < headerCount || cells.length < 2) continue;
+    lastRendered = rows[i];
+    var rank = cells[1].innerText.trim();
+    if (!rank || collected[rank]) continue;
+    result.push(Array.prototype.map.call(cells, cellText));
+}
+if (lastRendered) lastRendered.scrollIntoView();
+return result;
+"""
+
+driver = None # Chrome driver used by the single page mode, started in __main__
+
+def startDriver(debugPort=None, leanLoad=None):
+    """
+    Starts Chrome and returns its driver. If debugPort is set, attaches to the Chrome instance listening on that remote debugging port, starting it first
+    (detached from this script, with its own profile folder) if it is not running yet. Such an instance keeps running after the script exits, so the next run gets a warm browser.
+    leanLoad (LEAN_LOAD if not set) turns on the lean-load mode, see applyLeanLoad()
+    """
+    leanLoad = LEAN_LOAD if leanLoad is None else leanLoad
+    options = webdriver.ChromeOptions()
+    if debugPort:
+        if not isPortOpen(debugPort):
+            chromeArguments = [CHROME_BINARY_PATH, '--remote-debugging-port=' + str(debugPort), '--user-data-dir=' + os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chrome-profiles', str(debugPort)), BROWSER_SIZE]
+            if (platform.system() != 'Windows'):
+                chromeArguments.append('--headless=new')
+            subprocess.Popen(chromeArguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True) # New session, so Chrome is not killed together with the script
+            waitUntil = time.time() + TIMEOUT
+            while not isPortOpen(debugPort) and time.time() < waitUntil:
+                time.sleep(POLLING_FREQUENCY)
+        options.debugger_address = '127.0.0.1:' + str(debugPort) # Other options can not be set when attaching to a running Chrome
+    else:
+        options.add_experimental_option('excludeSwitches', ['enable-logging']) # This will silence "USB Device not functioning" errors Chrome might return
+        options.add_argument(BROWSER_SIZE)
+        if (platform.system() != 'Windows'): # Hide Chrome browser if the script is run on a Linux server, which most porbably does not have a display
+            options.add_argument('headless') # 'headless' will keep Chrome browser hidden
+        if leanLoad and BLOCK_IMAGES:
+            options.add_experimental_option('prefs', {'profile.managed_default_content_settings.images': 2}) # 2 = block
+    if leanLoad:
+        options.page_load_strategy = 'eager' # driver.get() returns once the DOM is ready, the table is awaited with FIRST_LOAD_XPATH anyway
+    chrome_service = Service(CHROMEDRIVER_PATH)
+    browser = webdriver.Chrome(service=chrome_service, options=options)
+    if leanLoad:
+        applyLeanLoad(browser)
+    return browser
+
+def applyLeanLoad(browser):
+    """
+    Uses Chrome DevTools Protocol so that nothing the table does not need is downloaded: requests matching BLOCKED_URL_PATTERNS (ads, analytics, fonts, ...) are
+    blocked, images too with BLOCK_IMAGES (also on attached warm instances, whose preferences can not be set), and CONSENT_COOKIES are set before the page is loaded,
+    so the consent banner is not shown. Chrome can only block by URL this way, so resource types are blocked through their file extensions
+    """
+    patterns = list(BLOCKED_URL_PATTERNS)
+    if BLOCK_IMAGES:
+        patterns.extend(['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.svg', '*.ico'])
+    browser.execute_cdp_cmd('Network.enable', {})
+    browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': patterns})
+    for cookie in CONSENT_COOKIES:
+        name, _, value = cookie.partition('=')
+        browser.execute_cdp_cmd('Network.setCookie', {'name': name.strip(), 'value': value.strip(), 'url': WEBSITE_URL})
+
+def isPortOpen(port):
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as connection:
+        connection.settimeout(0.5)
+        return connection.connect_ex(('127.0.0.1', port)) == 0
+
+class chromeDriverPool():
+    """
+    A fixed number of long-lived Chrome drivers shared by the threads scraping pages. With KEEP_BROWSERS_WARM, the Chrome instances are left running on close()
+    and the next run attaches to them instead of paying the Chrome startup again
+    """
+    def __init__(self, size, keepWarm):
+        self.keepWarm = keepWarm
+        self.drivers = queue.Queue()
+        with ThreadPoolExecutor(max_workers=size) as executor: # Start the browsers in parallel, Chrome startup is the slow part
+            starts = [executor.submit(startDriver, DEBUG_PORT_BASE + n if keepWarm else None) for n in range(size)]
+        failed = [start.exception() for start in starts if start.exception() is not None]
+        if failed: # Do not leave the browsers that did start running
+            for start in starts:
+                if start.exception() is None:
+                    self.release(start.result())
+            raise failed[0]
+        for start in starts:
+            self.drivers.put(start.result())
+        self.size = size
+
+    @contextmanager
+    def acquire(self):
+        pooledDriver = self.drivers.get() # Blocks until a driver is free
+        try:
+            yield pooledDriver
+        finally:
+            self.drivers.put(pooledDriver)
+
+    def release(self, pooledDriver):
+        if self.keepWarm:
+            pooledDriver.service.stop() # Only stop ChromeDriver, the Chrome instance keeps running for the next run
+        else:
+            pooledDriver.quit()
+
+    def close(self):
+        for n in range(self.size):
+            self.release(self.drivers.get())
+
+def writeTableData(data):
+    """
+    Saves the scraped rows to the csv file and, with NORMALIZED_OUTPUT, appends them as a typed snapshot to the history
+    """
+    with open(OUTPUTFOLDER_PATH+'/table_data.csv', 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerows(data)
+    if NORMALIZED_OUTPUT:
+        saveSnapshot(data, datetime.now(timezone.utc))
+
+SUBSCRIPT_DIGITS = str.maketrans('₀₁₂₃₄₅₆₇₈₉', '0123456789')
+
+def parseNumber(text):
+    """
+    Parses a number as the table displays it, e.g. "$29,399.49" -> 29399.49, "-3.36%" -> -3.36, "19,365,312 BTC" -> 19365312.0, "$1.2B" -> 1200000000.0,
+    and small prices written with a subscript count of zeros after the decimal point, e.g. "$0.0₅8971" -> 0.000008971. Returns None if there is no number
+    """
+    text = re.sub(r'\.0([₀-₉]+)', lambda zeros: '.' + '0' * int(zeros.group(1).translate(SUBSCRIPT_DIGITS)), text or '')
+    match = re.search(r'-?[\d,]*\.?\d+', text)
+    if not match:
+        return None
+    number = float(match.group(0).replace(',', ''))
+    suffix = text[match.end():match.end() + 1].upper()
+    return number * {'K': 1e3, 'M': 1e6, 'B': 1e9, 'T': 1e12}.get(suffix, 1)
+
+def normalizeRows(data, snapshotTime):
+    """
+    Turns the displayed rows into typed columns: name and symbol, and volume in USD and in coins, are split; currency, percentages and supply are parsed into numbers;
+    the empty first column and the chart/menu columns are dropped and the snapshot time is added. Changes are signed, every extract and fetch mode writes them as e.g. -3.36%
+    """
+    columns = {'snapshot_time': [], 'rank': [], 'name': [], 'symbol': [], 'price_usd': [], 'change_1h_pct': [], 'change_24h_pct': [], 'change_7d_pct': [],
+               'market_cap_usd': [], 'volume_24h_usd': [], 'volume_24h_coin': [], 'circulating_supply': []}
+    for row_data in data:
+        if len(row_data) < 10 or not row_data[1].strip().isdigit():
+            continue # Not a coin row
+        name, _, symbol = row_data[2].partition('\n')
+        volume, _, volumeInCoin = row_data[8].partition('\n')
+        columns['snapshot_time'].append(snapshotTime)
+        columns['rank'].append(int(row_data[1]))
+        columns['name'].append(name.strip())
+        columns['symbol'].append(symbol.strip())
+        columns['price_usd'].append(parseNumber(row_data[3]))
+        columns['change_1h_pct'].append(parseNumber(row_data[4]))
+        columns['change_24h_pct'].append(parseNumber(row_data[5]))
+        columns['change_7d_pct'].append(parseNumber(row_data[6]))
+        columns['market_cap_usd'].append(parseNumber(row_data[7]))
+        columns['volume_24h_usd'].append(parseNumber(volume))
+        columns['volume_24h_coin'].append(parseNumber(volumeInCoin))
+        columns['circulating_supply'].append(parseNumber(row_data[9]))
+    return columns
+
+SNAPSHOT_SCHEMA = None if pyarrow is None else pyarrow.schema([
+    ('snapshot_time', pyarrow.timestamp('s', tz='UTC')), ('rank', pyarrow.int32()), ('name', pyarrow.string()), ('symbol', pyarrow.string()),
+    ('price_usd', pyarrow.float64()), ('change_1h_pct', pyarrow.float64()), ('change_24h_pct', pyarrow.float64()), ('change_7d_pct', pyarrow.float64()),
+    ('market_cap_usd', pyarrow.float64()), ('volume_24h_usd', pyarrow.float64()), ('volume_24h_coin', pyarrow.float64()), ('circulating_supply', pyarrow.float64())])
+
+def saveSnapshot(data, snapshotTime):
+    """
+    Appends the normalized rows as a new file under HISTORY_PATH/date=YYYY-MM-DD/ (hive partitioning), so months of snapshots can be loaded as one dataset,
+    e.g. pyarrow.dataset.dataset(HISTORY_PATH, partitioning='hive') or pandas.read_parquet(HISTORY_PATH). Existing files are never rewritten
+    """
+    if pyarrow is None:
+        print(" * ERROR - NORMALIZED_OUTPUT needs pyarrow (pip install pyarrow), snapshot not saved")
+        return
+    table = pyarrow.Table.from_pydict(normalizeRows(data, snapshotTime), schema=SNAPSHOT_SCHEMA)
+    partition = os.path.join(HISTORY_PATH, 'date=' + snapshotTime.strftime('%Y-%m-%d'))
+    os.makedirs(partition, exist_ok=True)
+    fileName = os.path.join(partition, 'snapshot-' + snapshotTime.strftime('%H%M%S-%f'))
+    if HISTORY_FORMAT == 'arrow':
+        with pyarrow.ipc.new_file(fileName + '.arrow', SNAPSHOT_SCHEMA) as writer:
+            writer.write_table(table)
+    else:
+        pyarrow.parquet.write_table(table, fileName + '.parquet', compression='zstd')
+    print('Saved {} normalized rows to {}'.format(table.num_rows, partition))
 
 def saveTableToCsv():
     """
-    Saves the table on crypto prices on CoinMarketCap's first page to a csv file. Scrapes rows in batches and keeps scrolling down the page to get table rows fetched as 
-    virtual scrolling is used (a table with 100 empty rows gets rendered on DOM but only the visible ~20 rows have data).
+    Saves the table on crypto prices on CoinMarketCap's first page to a csv file.
     """
     global driver
+    data = scrapeTable(driver, TOTAL_TABLE_ROWS_PER_PAGE)
+        
+    writeTableData(data) # Save the data to a CSV file
+
+# Async script for EXTRACT_MODE rank: optionally scrolls down by one viewport (arguments[1]), waits until every table row in the viewport is rendered
+# (a MutationObserver re-checks on each DOM change, giving up after arguments[2] ms) and returns the rendered rows in the viewport whose rank is not in arguments[0],
+# the scroll position and whether the bottom of the page was reached
+CAPTURE_WINDOW_SCRIPT = CELL_TEXT_SCRIPT + """
+var collected = arguments[0], scroll = arguments[1], timeoutMs = arguments[2], done = arguments[arguments.length - 1];
+var table = document.querySelector('.cmc-table');
+var headerCount = table.querySelectorAll('thead th').length;
+function viewportRows() {
+    var rows = table.querySelectorAll('tbody tr'), result = [], pending = 0;
+    for (var i = 0; i < rows.length; i++) {
+        var rect = rows[i].getBoundingClientRect();
+        if (rect.bottom <= 0 || rect.top >= window.innerHeight) continue;
+        var cells = rows[i].querySelectorAll('td');
+        var rank = cells.length > 1 ? cells[1].innerText.trim() : '';
+        if (cells.length < headerCount || !rank) { pending++; continue; }
+        if (!collected[rank]) result.push(Array.prototype.map.call(cells, cellText));
+    }
+    return {rows: result, pending: pending};
+}
+function state() {
+    var current = viewportRows();
+    current.atBottom = window.innerHeight + window.scrollY >= document.documentElement.scrollHeight - 2;
+    current.scrollY = window.scrollY;
+    return current;
+}
+if (scroll) window.scrollBy(0, Math.floor(window.innerHeight * 0.9)); // Keep a small overlap so no row falls between two windows
+if (viewportRows().pending === 0) {
+    done(state());
+} else {
+    var timer;
+    var observer = new MutationObserver(function () {
+        if (viewportRows().pending === 0) { observer.disconnect(); clearTimeout(timer); done(state()); }
+    });
+    observer.observe(table, {childList: true, subtree: true, characterData: true});
+    timer = setTimeout(function () { observer.disconnect(); done(state()); }, timeoutMs);
+}
+"""
+
+def scrapeTable(browser, totalRows, firstRank=1):
+    """
+    Returns the rows of the crypto prices table on the page open in the received driver. Scrapes rows in batches and keeps scrolling down the page to get table rows fetched as 
+    virtual scrolling is used (a table with 100 empty rows gets rendered on DOM but only the visible ~20 rows have data).
+    """
+    if EXTRACT_MODE == 'js':
+        return scrapeTableWithJavaScript(browser, totalRows)
+    if EXTRACT_MODE == 'rank':
+        return scrapeTableByRank(browser, totalRows, firstRank)
     print('Saving table contents row by row to csv:')
     
     data = []
     noOfIterations = 0
     lastRow = ''
-    iterations_count = TOTAL_TABLE_ROWS_PER_PAGE / (SCROLL_WHEN_INDEX-1)
+    iterations_count = totalRows / (SCROLL_WHEN_INDEX-1)
 
     while noOfIterations < iterations_count:
         if lastRow:
-            driver.execute_script("arguments[0].scrollIntoView();", lastRow) # If lastRow is set, scroll to it using JavaScript so Coinmarketcap retrieves the table contents for the next set of rows
-        table = driver.find_element(By.CSS_SELECTOR, '.cmc-table') # Find the table and iterate over its rows to extract data
+            browser.execute_script("arguments[0].scrollIntoView();", lastRow) # If lastRow is set, scroll to it using JavaScript so Coinmarketcap retrieves the table contents for the next set of rows
+        table = browser.find_element(By.CSS_SELECTOR, '.cmc-table') # Find the table and iterate over its rows to extract data
 
         rows = table.find_elements(By.CSS_SELECTOR, 'tr')
         topRows = rows[noOfIterations*SCROLL_WHEN_INDEX:SCROLL_WHEN_INDEX*(noOfIterations+1)] # Get the first 10 rows. Set SCROLL_WHEN_INDEX to +1 of the desired row number, i.e. to 11.
@@ -92,42 +373,362 @@ def saveTableToCsv():
             try: # contents of the table get updated frequently, so guard the script against stale element reference and re-capture the missed element
                 cells = row.find_elements(By.CSS_SELECTOR, 'td')
                 if cells:
-                    row_data = [cell.text for cell in cells]
+                    row_data = [cellText(cell) for cell in cells]
                     print(row_data) # Display the contents of the row copied over
                     data.append(row_data)
             except Exception as e:
                 print(" * ERROR - Error while parsing table, contents probably got changed")
                 print(e)
-                driver.quit() # Quit Chrome driver, otherwise the process will remain running
         lastRow = row
         noOfIterations = noOfIterations + 1
-        
-    # Save the data to a CSV file
-    with open(OUTPUTFOLDER_PATH+'/table_data.csv', 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerows(data)
 
-def takeScreenshot():
+    return data[:totalRows]
+
+def cellText(cell):
+    """
+    Text of a table cell. With NORMALIZED_OUTPUT, a "-" is added to changes shown with a down arrow, at the cost of one extra request per cell showing a percentage,
+    so the default webdriver scrape sends no more requests than before and keeps the changes unsigned, as the table shows them
+    """
+    text = cell.text
+    if NORMALIZED_OUTPUT and text.endswith('%') and not text.startswith('-') and cell.find_elements(By.CSS_SELECTOR, CARET_DOWN_SELECTOR):
+        return '-' + text
+    return text
+
+def scrapeTableWithJavaScript(browser, totalRows):
+    """
+    Same rows as scrapeTable(), but each scroll window is read with a single execute_script call (EXTRACT_ROWS_SCRIPT) instead of one WebDriver round trip per row and cell,
+    which also avoids stale element errors as no element references are kept between calls. Rows are keyed by their rank, so rows already collected are skipped
+    """
+    print('Saving table contents to csv, one scroll window at a time:')
+    collected = {} # rank -> row
+    giveUpAt = time.time() + TIMEOUT
+    while len(collected) < totalRows and time.time() < giveUpAt:
+        newRows = browser.execute_script(EXTRACT_ROWS_SCRIPT, {rank: True for rank in collected})
+        for row_data in newRows:
+            print(row_data) # Display the contents of the row copied over
+            collected[row_data[1].strip()] = row_data
+        if newRows:
+            giveUpAt = time.time() + TIMEOUT # Rows are still coming in, reset the timeout
+        else:
+            time.sleep(POLLING_FREQUENCY) # Next rows are not rendered yet
+
+    ranks = sorted(collected, key=lambda rank: int(rank) if rank.isdigit() else 0)
+    return [collected[rank] for rank in ranks][:totalRows]
+
+def feedSession():
+    """
+    Returns a requests session with a connection pool large enough for the pages fetched in parallel, so connections are reused
+    """
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=max(DRIVER_POOL_SIZE, 4))
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    session.headers.update({'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36', 'Accept-Language': 'en-US,en;q=0.9'})
+    return session
+
+def parseEmbeddedListing(html):
+    """
+    Returns the coins listed in the JSON state embedded in the page (<script id="__NEXT_DATA__">), as a list of dictionaries with dotted keys, e.g. {'cmcRank': 1, 'name': 'Bitcoin', 'quote.USD.price': 29399.49, ...}.
+    The page stores the listing either as objects or in a compressed form, where the first item holds the keys ("keysArr") and every other item is a list of values
+    """
+    match = re.search(r'<script id="__NEXT_DATA__" type="application/json"[^>]*>(.*?)</script>', html, re.DOTALL)
+    if not match:
+        raise ValueError('The page does not include the __NEXT_DATA__ JSON state')
+    state = json.loads(match.group(1))['props']['initialState']
+    if isinstance(state, str): # initialState is itself JSON encoded
+        state = json.loads(state)
+    listing = state['cryptocurrency']['listingLatest']['data']
+
+    if listing and isinstance(listing[0], dict) and 'keysArr' in listing[0]:
+        keys = listing[0]['keysArr']
+        return [dict(zip(keys, values)) for values in listing[1:]]
+    return [flattenCoin(coin) for coin in listing]
+
+def flattenCoin(coin):
+    """
+    Flattens a coin of the listing endpoint (quotes: [{'name': 'USD', 'price': ...}]) or of the uncompressed page state (quote: {'USD': {'price': ...}}) to dotted keys
+    """
+    flat = {key: value for key, value in coin.items() if not isinstance(value, (dict, list))}
+    for quote in coin.get('quotes', []):
+        for key, value in quote.items():
+            flat['quote.' + quote['name'] + '.' + key] = value
+    for currency, quote in coin.get('quote', {}).items():
+        for key, value in quote.items():
+            flat['quote.' + currency + '.' + key] = value
+    return flat
+
+def formatPrice(price):
+    """
+    Formats a price like the table does: 2 decimals from $1 up, 4 significant digits below, e.g. $29,399.49 or $0.00001234
+    """
+    if price is None:
+        return ''
+    if price >= 1 or price <= 0:
+        return '${:,.2f}'.format(price)
+    return '${:,.{}f}'.format(price, max(2, 3 - math.floor(math.log10(price))))
+
+def coinToRow(coin):
+    """
+    Returns the row the table shows for a coin, with the same columns as the scraped csv: an empty first column, rank, "Name\nSYMBOL", price, 1h/24h/7d change,
+    market cap, "volume\nvolume in coins", circulating supply and the two empty chart/menu columns. Changes keep their sign, which the table shows as an up/down arrow, e.g. -3.36%
+    """
+    symbol = coin['symbol']
+    price = coin.get('quote.USD.price')
+    volume = coin.get('quote.USD.volume24h') or 0
+    row_data = ['', str(coin['cmcRank']), coin['name'] + '\n' + symbol, formatPrice(price)]
+    for change in ('percentChange1h', 'percentChange24h', 'percentChange7d'):
+        value = coin.get('quote.USD.' + change)
+        row_data.append('' if value is None else '{:.2f}%'.format(value))
+    row_data.append('${:,.0f}'.format(coin.get('quote.USD.marketCap') or 0))
+    row_data.append('${:,.0f}'.format(volume) + '\n' + '{:,.0f} {}'.format(volume / price if price else 0, symbol))
+    row_data.append('{:,.0f} {}'.format(coin.get('circulatingSupply') or 0, symbol))
+    row_data.extend(['', ''])
+    return row_data
+
+def fetchFeedPage(session, pageNumber, rowsPerPage):
+    """
+    Returns the coins of one page of the table, from the page's embedded JSON state or from the listing endpoint depending on FEED_SOURCE.
+    A fixture (FEED_FIXTURE_PATH) is read as the whole listing, so each page only gets its own slice of it and pages past its end get no coins
+    """
+    if FEED_FIXTURE_PATH:
+        with open(FEED_FIXTURE_PATH, encoding='utf-8') as fixture:
+            start = (pageNumber - 1) * TOTAL_TABLE_ROWS_PER_PAGE
+            return parseEmbeddedListing(fixture.read())[start:start + rowsPerPage]
+    if FEED_SOURCE == 'api':
+        params = {'start': (pageNumber - 1) * TOTAL_TABLE_ROWS_PER_PAGE + 1, 'limit': rowsPerPage, 'sortBy': 'market_cap', 'sortType': 'desc', 'convert': 'USD', 'cryptoType': 'all', 'tagType': 'all', 'audited': 'false'}
+        response = session.get(FEED_API_URL, params=params, timeout=TIMEOUT)
+        response.raise_for_status()
+        return [flattenCoin(coin) for coin in response.json()['data']['cryptoCurrencyList']]
+    response = session.get(WEBSITE_URL + ('?page=' + str(pageNumber) if pageNumber > 1 else ''), timeout=TIMEOUT)
+    response.raise_for_status()
+    return parseEmbeddedListing(response.text)[:rowsPerPage]
+
+def saveFeedToCsv():
     """
-    Gets workbook name and dashboard name, opens the dashoard in Chrome, waits for it to fully load and saves a 200x150 pixel screnshot in png & webp formats
-    Saves the screenshot as {workbookname}+{dashboardname} with alphanumkerical characters escaped:
-    e.g. "ClientProfiler" -> "Top/Bottom Traders" screenshot will be saved as "ClientProfiler-TopBottomTraders.webp" with "/" and spaces removed
+    Browserless alternative to saveTableToCsv()/saveAllPagesToCsv(): fetches the table data as JSON (TOTAL_ROWS rows in multi-page mode, otherwise TOTAL_TABLE_ROWS_PER_PAGE),
+    pages in parallel over a pooled HTTP session, and writes the same csv columns the browser scrape produces
+    """
+    totalRows = TOTAL_ROWS if MULTI_PAGE_MODE else TOTAL_TABLE_ROWS_PER_PAGE
+    pages = math.ceil(totalRows / TOTAL_TABLE_ROWS_PER_PAGE)
+    rowsPerPage = [min(TOTAL_TABLE_ROWS_PER_PAGE, totalRows - (pageNumber - 1) * TOTAL_TABLE_ROWS_PER_PAGE) for pageNumber in range(1, pages + 1)]
+    print('Fetching {} rows over {} pages without a browser'.format(totalRows, pages))
+
+    data = []
+    session = feedSession()
+    with ThreadPoolExecutor(max_workers=max(DRIVER_POOL_SIZE, 1)) as executor:
+        for coins in executor.map(lambda pageNumber: fetchFeedPage(session, pageNumber, rowsPerPage[pageNumber - 1]), range(1, pages + 1)): # map() keeps the page order
+            data.extend(coinToRow(coin) for coin in coins)
+
+    writeTableData(data)
+
+def scrapeTableByRank(browser, totalRows, firstRank=1):
+    """
+    Collects the rows ranked firstRank to firstRank + totalRows - 1, keyed by rank, scrolling one measured viewport height at a time (CAPTURE_WINDOW_SCRIPT).
+    Each step waits until the rows in the viewport are rendered instead of sleeping a fixed time, and scrolling stops as soon as every wanted rank is collected,
+    so no row is dropped or duplicated when rendering lags. Capture stops after a step that makes no progress (no new row and the page did not scroll, e.g. a placeholder
+    row that never renders at the bottom of the table), and the ranks still missing then are reported
+    """
+    print('Saving table contents to csv, one viewport at a time:')
+    browser.set_script_timeout(TIMEOUT + 5)
+    wantedRanks = [str(rank) for rank in range(firstRank, firstRank + totalRows)]
+    collected = {} # rank -> row
+    browser.execute_script("document.querySelector('.cmc-table').scrollIntoView();")
+    scroll = False
+    steps = 0
+    lastScrollY = None
+    while any(rank not in collected for rank in wantedRanks):
+        window = browser.execute_async_script(CAPTURE_WINDOW_SCRIPT, {rank: True for rank in collected}, scroll, int(TIMEOUT * 1000))
+        for row_data in window['rows']:
+            print(row_data) # Display the contents of the row copied over
+            collected[row_data[1].strip()] = row_data
+        steps = steps + 1
+        scroll = True
+        if not window['rows'] and (window['scrollY'] == lastScrollY or (window['atBottom'] and window['pending'] == 0)):
+            break # No progress (or nothing left to scroll to), another step would only wait TIMEOUT again
+        lastScrollY = window['scrollY']
+
+    missingRanks = [rank for rank in wantedRanks if rank not in collected]
+    print('Collected {} rows in {} scroll steps'.format(totalRows - len(missingRanks), steps))
+    if missingRanks:
+        print(" * ERROR - Ranks not found in the table: " + ', '.join(missingRanks))
+    return [collected[rank] for rank in wantedRanks if rank in collected]
+
+def rowKey(row_data):
+    """
+    Returns the key of a coin row, its "Name\nSYMBOL" cell. Ranks move as prices change, so they can not identify a coin from one tick to the next
+    """
+    return row_data[2] if len(row_data) > 2 else ''
+
+class changeLog():
+    """
+    Appends each read of the table to a JSON Lines file per day under path. Every fullEvery ticks, and as the first record of each file, a "full" record holds every row;
+    in between, a "delta" record holds only the rows that are new or changed since the previous tick and the keys of the rows that left the table.
+    replayChangeLog() rebuilds the table of every tick from such a file
+    """
+    def __init__(self, path, fullEvery):
+        self.path = path
+        self.fullEvery = max(fullEvery, 1)
+        self.rows = {} # key -> row at the previous tick
+        self.ticks = 0
+        self.fileName = None
+
+    def append(self, data, tickTime):
+        rows = {rowKey(row_data): row_data for row_data in data if rowKey(row_data)}
+        fileName = os.path.join(self.path, 'changes-' + tickTime.strftime('%Y-%m-%d') + '.jsonl')
+        if fileName != self.fileName or self.ticks % self.fullEvery == 0:
+            record = {'type': 'full', 'time': tickTime.isoformat(), 'rows': rows}
+        else:
+            record = {'type': 'delta', 'time': tickTime.isoformat(),
+                      'changed': {key: row_data for key, row_data in rows.items() if self.rows.get(key) != row_data},
+                      'removed': [key for key in self.rows if key not in rows]}
+        os.makedirs(self.path, exist_ok=True)
+        with open(fileName, 'a', encoding='utf-8') as changesFile:
+            changesFile.write(json.dumps(record, separators=(',', ':')) + '\n')
+        self.fileName = fileName
+        self.rows = rows
+        self.ticks = self.ticks + 1
+        return record
+
+def replayChangeLog(fileName):
+    """
+    Yields (time, rows in rank order) for every tick stored in a change log file written by changeLog
+    """
+    rows = {}
+    with open(fileName, encoding='utf-8') as changesFile:
+        for line in changesFile:
+            record = json.loads(line)
+            if record['type'] == 'full':
+                rows = record['rows']
+            else:
+                rows.update(record['changed'])
+                for key in record['removed']:
+                    rows.pop(key, None)
+            yield record['time'], sorted(rows.values(), key=lambda row_data: int(row_data[1]) if row_data[1].strip().isdigit() else 0)
+
+def scrollToTable(browser):
+    """
+    Scrolls back to the top of the page and then to the table, so its first rows are rendered again before the next read
+    """
+    browser.execute_script("window.scrollTo(0, 0);")
+    element = WebDriverWait(browser, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, SCROLL_TO_ELEMENT)) )
+    browser.execute_script("arguments[0].scrollIntoView();", element)
+
+def runDaemon():
+    """
+    Re-reads the table on the page already open in the driver every POLL_INTERVAL seconds and appends it to the change log, until the script is stopped (Ctrl+C).
+    The page updates its prices live, so it is only reloaded when a read fails. The csv file (and the normalized history) is rewritten on full snapshots only
     """
     global driver
-    print('Taking the screenshot of the page')
-    fileName = 'screenshot'
-    pngImage = OUTPUTFOLDER_PATH + '/' + fileName + '.png'
-    webpImage = OUTPUTFOLDER_PATH + '/' + fileName + '.webp'
+    log = changeLog(CHANGES_PATH, FULL_SNAPSHOT_EVERY)
+    print('Reading the table every {} seconds, press Ctrl+C to stop'.format(POLL_INTERVAL))
+    try:
+        while True:
+            tickStart = time.time()
+            try:
+                scrollToTable(driver)
+                data = scrapeTable(driver, TOTAL_TABLE_ROWS_PER_PAGE)
+                if len(data) < TOTAL_TABLE_ROWS_PER_PAGE: # A partial read would be stored as rows leaving the table
+                    raise ValueError('Only {} of {} rows were read'.format(len(data), TOTAL_TABLE_ROWS_PER_PAGE))
+                record = log.append(data, datetime.now(timezone.utc))
+                if record['type'] == 'full':
+                    writeTableData(data)
+                    print('Stored a full snapshot of {} rows'.format(len(record['rows'])))
+                else:
+                    print('Stored {} changed rows'.format(len(record['changed']) + len(record['removed'])))
+            except Exception as e:
+                print(" * ERROR - Failed to read the table, reloading the page")
+                print(e)
+                try:
+                    driver.refresh()
+                    WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, FIRST_LOAD_XPATH)) )
+                    closePopups(driver)
+                except Exception as e:
+                    print(" * ERROR - Failed to reload the page")
+                    print(e)
+            time.sleep(max(0, POLL_INTERVAL - (time.time() - tickStart))) # Keep a steady interval whatever the read took
+    except KeyboardInterrupt:
+        print('Daemon stopped')
+
+def closePopups(browser):
+    """
+    Closes the cookie consent banner and the ads window if they are displayed
+    """
+    # Check if consent banner appeared CONSENT_PAGE_ID
+    consent = browser.find_elements(By.XPATH, CONSENT_PAGE_ID)
+    if consent:
+        print("Consent banner is displayed")
+        WebDriverWait(browser, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, CONSENT_CLOSE_XPATH)) ).click()
+        print("Closed the consent banner")
+
+    # Check if consent banner appeared CONSENT_PAGE_ID
+    adsWindow = browser.find_elements(By.XPATH, ADS_CONTAINER)
+    if adsWindow:
+        print("There is an ads window")
+        WebDriverWait(browser, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, ADS_CONTAINER_CLOSE)) ).click()
+        print("Closed the ads container")
+
+def scrapePage(pool, pageNumber, totalRows):
+    """
+    Loads page pageNumber of the table (?page=N) in a driver from the pool and returns its first totalRows rows. The screenshot is taken from the first page
+    """
+    with pool.acquire() as browser:
+        url = WEBSITE_URL + ('?page=' + str(pageNumber) if pageNumber > 1 else '')
+        print('Navigating to: ' + url)
+        browser.get(url)
+        WebDriverWait(browser, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, FIRST_LOAD_XPATH)) )
+        closePopups(browser)
+        element = WebDriverWait(browser, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, SCROLL_TO_ELEMENT)) )
+        browser.execute_script("arguments[0].scrollIntoView();", element)
+        if pageNumber == 1:
+            takeScreenshot(browser)
+        return scrapeTable(browser, totalRows, (pageNumber - 1) * TOTAL_TABLE_ROWS_PER_PAGE + 1)
+
+def saveAllPagesToCsv(pool):
+    """
+    Scrapes TOTAL_ROWS rows, TOTAL_TABLE_ROWS_PER_PAGE per page, loading the pages in parallel on the drivers of the pool, and saves them to the csv file in rank order
+    """
+    pages = math.ceil(TOTAL_ROWS / TOTAL_TABLE_ROWS_PER_PAGE)
+    rowsPerPage = [min(TOTAL_TABLE_ROWS_PER_PAGE, TOTAL_ROWS - (pageNumber - 1) * TOTAL_TABLE_ROWS_PER_PAGE) for pageNumber in range(1, pages + 1)]
+    print('Scraping {} rows over {} pages with {} browsers'.format(TOTAL_ROWS, pages, pool.size))
+
+    data = []
+    with ThreadPoolExecutor(max_workers=pool.size) as executor:
+        for pageRows in executor.map(lambda pageNumber: scrapePage(pool, pageNumber, rowsPerPage[pageNumber - 1]), range(1, pages + 1)): # map() keeps the page order
+            data.extend(pageRows)
+
+    writeTableData(data)
+
+imageEncoder = ThreadPoolExecutor(max_workers=1) # Encodes the screenshots in the background while the table is being scraped
 
+def takeScreenshot(browser=None):
+    """
+    Captures the page (or with SCREENSHOT_CROP table, the SCROLL_TO_ELEMENT table only) in memory and hands it over to the image encoder thread,
+    which saves it as screenshot.png & screenshot.webp, resized to fit IMAGE_WIDTH x IMAGE_HEIGHT. Returns the future of the encoding, so scraping can go on meanwhile
+    """
+    global driver
+    browser = browser or driver
+    print('Taking the screenshot of the page')
+    if SCREENSHOT_CROP == 'table':
+        pngData = browser.find_element(By.XPATH, SCROLL_TO_ELEMENT).screenshot_as_png
+    else:
+        pngData = browser.get_screenshot_as_png() # No round trip through the disk
+    return imageEncoder.submit(encodeScreenshot, pngData, 'screenshot')
 
-    driver.save_screenshot(pngImage) # Save png format as fallback image as well in case customer's browser does not support webp format
-    image = Image.open(open(pngImage, 'rb'))
-    image.thumbnail((IMAGE_WIDTH, IMAGE_HEIGHT))  # .thumbnail() method changes the Image object in place and doesn’t return a new object. Expects a tuple for size (width, height)
-    image.save(pngImage, format='png')
-    image = image.convert('RGB')
-    image.save(webpImage, format='webp')
-    image.close() # Close the image
-    image = None # Clear the image variable
+def encodeScreenshot(pngData, fileName):
+    """
+    Saves the captured png as a thumbnail in png & webp formats. Runs on the image encoder thread, so errors are reported here
+    """
+    try:
+        pngImage = OUTPUTFOLDER_PATH + '/' + fileName + '.png'
+        webpImage = OUTPUTFOLDER_PATH + '/' + fileName + '.webp'
+        with Image.open(io.BytesIO(pngData)) as image:
+            image.thumbnail((IMAGE_WIDTH, IMAGE_HEIGHT))  # .thumbnail() method changes the Image object in place and doesn’t return a new object. Expects a tuple for size (width, height)
+            image.save(pngImage, format='png') # Save png format as fallback image as well in case customer's browser does not support webp format
+            image.convert('RGB').save(webpImage, format='webp', quality=WEBP_QUALITY, method=WEBP_METHOD)
+        print('Saved the screenshot')
+    except Exception as e:
+        print(" * ERROR - Failed to save the screenshot")
+        print(e)
 
 # START
 # ==================================================================
@@ -135,54 +736,90 @@ if __name__ == "__main__":
     # Prepare the directory screenshots will be placed in. This will make sure there is an empty folder at script start.
     if not os.path.exists(OUTPUTFOLDER_PATH): # check if target folder to save the images in is present. If not, create it
         os.makedirs(OUTPUTFOLDER_PATH)
-    else:  # If the folder exists, delete and create and empty one, so any previous screenshots get deleted and replaced when script is re-run
+    elif not DAEMON_MODE:  # If the folder exists (and the daemon mode, which only appends, is off), delete and create and empty one, so any previous screenshots get deleted and replaced when script is re-run
         try:
             shutil.rmtree(OUTPUTFOLDER_PATH)
             os.makedirs(OUTPUTFOLDER_PATH)
         except OSError as e:
             print ("Error: %s - %s." % (e.filename, e.strerror))
-            driver.quit() # Quit Chrome driver, otherwise the process will remain running
-
-    # Visit the website
-    print('Navigating to: ' + WEBSITE_URL)
-    driver.get(WEBSITE_URL)
 
-    try:
-        # Wait for page to get rendered in DOM until TIMEOUT in config.ini 
-        watchlist = WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, FIRST_LOAD_XPATH)) ) # Wait until the element defined in FIRST_LOAD_XPATH gets loaded
-        print("Page loaded")
-
-        # Check if consent banner appeared CONSENT_PAGE_ID
-        consent = driver.find_elements(By.XPATH, CONSENT_PAGE_ID)
-        if consent:
-            print("Consent banner is displayed")
-            WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, CONSENT_CLOSE_XPATH)) ).click()
-            print("Closed the consent banner")
-
-        # Check if consent banner appeared CONSENT_PAGE_ID
-        adsWindow = driver.find_elements(By.XPATH, ADS_CONTAINER)
-        if adsWindow:
-            print("There is an ads window")
-            WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, ADS_CONTAINER_CLOSE)) ).click()
-            print("Closed the ads container")
-
-        # Wait for Dealers folder to get rendered in DOM
+    if FETCH_MODE == 'feed':
         try:
-            element = WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, SCROLL_TO_ELEMENT)) ) # Wait until the SCROLL_TO_ELEMENT is loaded successfully
-            driver.execute_script("arguments[0].scrollIntoView();", element) # Scroll to the element using JavaScript
-            takeScreenshot()
-            saveTableToCsv()
+            saveFeedToCsv()
         except Exception as e:
-            print(" * ERROR - Could not locate the SCROLL_TO_ELEMENT element")
+            print(" * ERROR - Failed to fetch the table data")
             print(e)
-            driver.quit() # Quit Chrome driver, otherwise the process will remain running
-    except Exception as e:
-            print(" * ERROR - Failed to locate the FIRST_LOAD_XPATH element")
+        if FEED_SCREENSHOT: # Chrome is only needed for the screenshot
+            driver = startDriver()
+            print('Navigating to: ' + WEBSITE_URL)
+            driver.get(WEBSITE_URL)
+            try:
+                WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, FIRST_LOAD_XPATH)) )
+                closePopups(driver)
+                element = WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, SCROLL_TO_ELEMENT)) )
+                driver.execute_script("arguments[0].scrollIntoView();", element)
+                takeScreenshot()
+            except Exception as e:
+                print(" * ERROR - Failed to take the screenshot")
+                print(e)
+    elif MULTI_PAGE_MODE:
+        pool = None
+        try:
+            pool = chromeDriverPool(DRIVER_POOL_SIZE, KEEP_BROWSERS_WARM)
+            saveAllPagesToCsv(pool)
+        except Exception as e:
+            print(" * ERROR - Failed to scrape the pages")
             print(e)
-            driver.quit() # Quit Chrome driver, otherwise the process will remain running
+        finally:
+            if pool:
+                pool.close() # Quit (or with KEEP_BROWSERS_WARM, detach from) the Chrome instances, otherwise the processes will remain running
+    elif DAEMON_MODE:
+        driver = startDriver()
+        print('Navigating to: ' + WEBSITE_URL)
+        driver.get(WEBSITE_URL)
+        try:
+            WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, FIRST_LOAD_XPATH)) )
+            print("Page loaded")
+            closePopups(driver)
+            scrollToTable(driver)
+            takeScreenshot()
+            runDaemon()
+        except Exception as e:
+            print(" * ERROR - Failed to load the page")
+            print(e)
+    else:
+        driver = startDriver()
+
+        # Visit the website
+        print('Navigating to: ' + WEBSITE_URL)
+        driver.get(WEBSITE_URL)
+
+        try:
+            # Wait for page to get rendered in DOM until TIMEOUT in config.ini 
+            watchlist = WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, FIRST_LOAD_XPATH)) ) # Wait until the element defined in FIRST_LOAD_XPATH gets loaded
+            print("Page loaded")
+
+            closePopups(driver) # Close the consent banner and the ads window if they appeared
+
+            # Wait for Dealers folder to get rendered in DOM
+            try:
+                element = WebDriverWait(driver, TIMEOUT).until( EC.presence_of_element_located((By.XPATH, SCROLL_TO_ELEMENT)) ) # Wait until the SCROLL_TO_ELEMENT is loaded successfully
+                driver.execute_script("arguments[0].scrollIntoView();", element) # Scroll to the element using JavaScript
+                takeScreenshot()
+                saveTableToCsv()
+            except Exception as e:
+                print(" * ERROR - Could not locate the SCROLL_TO_ELEMENT element")
+                print(e)
+                driver.quit() # Quit Chrome driver, otherwise the process will remain running
+        except Exception as e:
+                print(" * ERROR - Failed to locate the FIRST_LOAD_XPATH element")
+                print(e)
+                driver.quit() # Quit Chrome driver, otherwise the process will remain running
 
+    imageEncoder.shutdown(wait=True) # Let the screenshot encoding finish
     print('Creating a zip file of the images folder')
     # Uncomment hte line below to have the output folder zipped
     #shutil.make_archive('output', 'zip', OUTPUTFOLDER_PATH)
     print('Done')
-    driver.quit() # Quit Chrome driver
\ No newline at end of file
+    if driver:
+        driver.quit() # Quit Chrome driver
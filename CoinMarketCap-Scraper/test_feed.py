@@ -0,0 +1,40 @@
+# Checks the feed mode of scraper.py against the saved copy of the page in fixtures/ (no browser or network needed)
+#
+# Run with:    python -m pytest test_feed.py
+
+import os
+import scraper
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'coinmarketcap_page.html')
+
+def readFixture():
+    with open(FIXTURE_PATH, encoding='utf-8') as fixture:
+        return fixture.read()
+
+def test_parseEmbeddedListing():
+    coins = scraper.parseEmbeddedListing(readFixture())
+    assert [coin['cmcRank'] for coin in coins] == [1, 2, 3, 15]
+    assert [coin['symbol'] for coin in coins] == ['BTC', 'ETH', 'USDT', 'SHIB']
+    assert coins[0]['quote.USD.price'] == 29399.4912
+    assert coins[1]['quote.USD.percentChange7d'] == -3.3612
+
+def test_coinToRow():
+    rows = [scraper.coinToRow(coin) for coin in scraper.parseEmbeddedListing(readFixture())]
+    assert rows[0] == ['', '1', 'Bitcoin\nBTC', '$29,399.49', '0.04%', '-0.54%', '0.06%', '$569,330,235,391', '$17,386,641,703\n591,393 BTC', '19,365,312 BTC', '', '']
+    assert rows[1][4:7] == ['0.18%', '3.47%', '-3.36%'] # Changes keep their sign
+    assert rows[3][1:4] == ['15', 'Shiba Inu\nSHIB', '$0.000008971']
+    assert all(len(row_data) == 12 for row_data in rows) # Same columns as the browser scrape
+
+def test_fixturePagesDoNotRepeat(monkeypatch):
+    monkeypatch.setattr(scraper, 'FEED_FIXTURE_PATH', FIXTURE_PATH)
+    monkeypatch.setattr(scraper, 'TOTAL_TABLE_ROWS_PER_PAGE', 2)
+    pages = [scraper.fetchFeedPage(None, pageNumber, 2) for pageNumber in (1, 2, 3)]
+    assert [[coin['cmcRank'] for coin in coins] for coins in pages] == [[1, 2], [3, 15], []]
+
+def test_normalizeRows():
+    rows = [scraper.coinToRow(coin) for coin in scraper.parseEmbeddedListing(readFixture())]
+    columns = scraper.normalizeRows(rows, None)
+    assert columns['symbol'] == ['BTC', 'ETH', 'USDT', 'SHIB']
+    assert columns['change_24h_pct'][0] == -0.54
+    assert columns['change_7d_pct'][1] == -3.36 # Signed, not the absolute value
+    assert scraper.parseNumber('$0.0₅8971') == 0.000008971 # Subscript count of zeros, as the table shows small prices
@@ -0,0 +1,174 @@
+
+# Syncs several Okta tenant -> VBout list mappings in one run, configured in multiTenant.ini:
+#
+# [general]          settings shared by every tenant and mapping (VBout account, SMTP, recipients, page sizes, ...) and the runner's own limits
+# [tenant:<name>]    an Okta org: oktaUrl, oktaApiKey and optionally its own checkpointFile, syncMode, oktaConcurrency, ...
+# [mapping:<name>]   tenant = <name>, vboutListToSync and excludedGroups of the list, optionally its own VBout account (vboutUrl, vboutApiKey) or planFile
+#
+# Each tenant is downloaded from Okta once (in full, or incrementally from its checkpoint), with the members of every group at least one of its mappings syncs.
+# Every mapping then filters that snapshot with its own excludedGroups, so N lists of the same tenant cost one Okta download instead of N.
+# All requests share one connection pool, the mappings of a tenant share its Okta rate limit scheduler, and one email reports on all tenants and mappings.
+#
+# Run with:    python multiTenantSync.py [--full]
+
+import configparser
+import os
+import requests
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from oktaVboutSync import oktaVboutSync
+
+class multiTenantSync():
+
+    def __init__(self, configFile='multiTenant.ini'):
+        self.config = configparser.RawConfigParser() # RawConfigParser sets interpolation to none so any % characters in the URLs can work
+        self.config.read(configFile)
+        self.maxParallelMappings = self.config.getint('general', 'maxParallelMappings', fallback=4) # Number of tenants downloaded, and then of mappings synced, at the same time
+        self.maxConnectionsPerHost = self.config.getint('general', 'maxConnectionsPerHost', fallback=10) # Global limit of requests in flight to each host (Okta org, VBout), whatever the number of mappings and worker threads
+
+        # Mappings of each tenant, in the order of the config file
+        self.tenants = {section.split(':', 1)[1]: [] for section in self.config.sections() if section.startswith('tenant:')}
+        if not self.tenants:
+            raise ValueError('No [tenant:<name>] section in ' + configFile)
+        for section in self.config.sections():
+            if section.startswith('mapping:'):
+                tenantName = self.config.get(section, 'tenant')
+                if tenantName not in self.tenants:
+                    raise ValueError('Mapping {} uses tenant {}, which has no [tenant:{}] section'.format(section, tenantName, tenantName))
+                self.tenants[tenantName].append(section.split(':', 1)[1])
+
+        # One keep-alive session for every tenant and mapping. pool_block makes requests wait for a free connection, so maxConnectionsPerHost is a hard limit
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=len(self.tenants) + 2, pool_maxsize=self.maxConnectionsPerHost, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.tenantSyncs = {} # tenant name -> oktaVboutSync holding the Okta snapshot of the tenant
+        self.mappingSyncs = {} # mapping name -> oktaVboutSync that synced the list, or the exception that stopped it
+
+    # Settings of a tenant or a mapping
+    def syncConfig(self, tenantName, mappingName=None):
+        '''
+        Returns a config in the format oktaVboutSync expects (a single [general] section): the [general] settings, overridden by those of the tenant and then of the mapping.
+        Each tenant gets its own checkpoint file and each mapping its own plan file unless the config sets them. The response cache is only used where a tenant or mapping sets cacheFile,
+        and a mapping inheriting the cacheFile of its tenant gets its own copy of the name (e.g. cache-<mapping>.sqlite for cache.sqlite), as the mappings of a tenant run in parallel
+        '''
+        settings = {'excludedgroups': '', 'vboutlisttosync': ''} # Only used by mappings, but read by every oktaVboutSync
+        settings.update(self.config.items('general'))
+        settings.pop('cachefile', None)
+        settings['checkpointfile'] = 'checkpoint-' + tenantName + '.json'
+        settings.update(self.config.items('tenant:' + tenantName))
+        if mappingName:
+            settings['planfile'] = 'plan-' + mappingName + '.jsonl'
+            if settings.get('cachefile'):
+                root, extension = os.path.splitext(settings['cachefile'])
+                settings['cachefile'] = root + '-' + mappingName + extension
+            settings.update(self.config.items('mapping:' + mappingName))
+        config = configparser.RawConfigParser()
+        config['general'] = settings
+        return config
+
+    # Download the Okta users of a tenant
+    def loadTenant(self, tenantName, full=False):
+        '''
+        Get the members of every group synced by at least one mapping of the tenant, incrementally from the tenant's checkpoint if syncMode is incremental.
+        Each user keeps all of its groups, so every mapping can apply its own excludedGroups afterwards
+        '''
+        sync = oktaVboutSync(self.syncConfig(tenantName), session=self.session)
+        syncStart = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z')
+        checkpoint = sync.loadCheckpoint() if sync.syncMode == 'incremental' and not full else None
+
+        with sync.metrics.phase('oktaGroups'):
+            sync.listGroups()
+        excludedByMapping = [set(self.syncConfig(tenantName, mappingName).get('general', 'excludedGroups').split(',')) for mappingName in self.tenants[tenantName]]
+        includedGroups = [group for group in sync.groups if any(group['name'] not in excludedGroups for excludedGroups in excludedByMapping)]
+        with sync.metrics.phase('oktaMembers'):
+            if checkpoint:
+                print("{}: getting Okta users changed since the last sync on {}".format(tenantName, checkpoint['lastSync']))
+                sync.getIncrementalOktaChanges(checkpoint, includedGroups)
+            else:
+                print("{}: getting members of {} Okta groups, {} at a time".format(tenantName, len(includedGroups), sync.oktaConcurrency))
+                sync.getAllOktaGroupMembers(includedGroups)
+        print("{}: {} Okta users".format(tenantName, len(sync.oktaUsers)))
+
+        if sync.oktaComplete: # Do not save a checkpoint built from incomplete Okta data
+            sync.saveCheckpoint(syncStart)
+        return sync
+
+    # Sync one VBout list from the snapshot of its tenant
+    def runMapping(self, mappingName, tenantSync):
+        '''
+        Filter the tenant's users down to the groups the mapping syncs, then read, plan and apply the changes of the mapping's VBout list as oktaVboutSync.py does
+        '''
+        tenantName = self.config.get('mapping:' + mappingName, 'tenant')
+        sync = oktaVboutSync(self.syncConfig(tenantName, mappingName), session=self.session, oktaScheduler=tenantSync.oktaScheduler)
+        excludedGroups = set(sync.excludedGroups.split(','))
+        for login in tenantSync.oktaUsers:
+            user = tenantSync.oktaUsers[login]
+            groups = [groupName for groupName in user.groups if groupName not in excludedGroups]
+            if groups:
+                sync.oktaUsers.setUser(login, user.firstName, user.lastName, user.created, groups)
+        sync.oktaComplete = tenantSync.oktaComplete # No deletes if the tenant's Okta data is incomplete
+
+        with sync.metrics.phase('vboutReads'):
+            sync.getVboutLists()
+        with sync.metrics.phase('plan'):
+            sync.writePlan(sync.planVboutChanges())
+        with sync.metrics.phase('vboutWrites'):
+            sync.applyPlan()
+        print("{}: {} Okta users synced to VBout list {}".format(mappingName, len(sync.oktaUsers), sync.vboutListToSync))
+        return sync
+
+    def run(self, full=False):
+        '''
+        Download the tenants in parallel, then sync the mappings in parallel, "maxParallelMappings" at a time. A mapping whose tenant could not be downloaded is reported and skipped
+        '''
+        with ThreadPoolExecutor(max_workers=max(self.maxParallelMappings, 1)) as executor:
+            tenantNames = [tenantName for tenantName, mappingNames in self.tenants.items() if mappingNames]
+            for tenantName, result in zip(tenantNames, [executor.submit(self.loadTenant, tenantName, full) for tenantName in tenantNames]):
+                try:
+                    self.tenantSyncs[tenantName] = result.result()
+                except Exception as e:
+                    oktaVboutSync.logger.exception("Loading tenant %s failed", tenantName)
+                    for mappingName in self.tenants[tenantName]:
+                        self.mappingSyncs[mappingName] = e
+
+            mappings = [(mappingName, tenantName) for tenantName, mappingNames in self.tenants.items() for mappingName in mappingNames if tenantName in self.tenantSyncs]
+            results = [executor.submit(self.runMapping, mappingName, self.tenantSyncs[tenantName]) for mappingName, tenantName in mappings]
+            for (mappingName, tenantName), result in zip(mappings, results):
+                try:
+                    self.mappingSyncs[mappingName] = result.result()
+                except Exception as e:
+                    oktaVboutSync.logger.exception("Mapping %s failed", mappingName)
+                    self.mappingSyncs[mappingName] = e
+
+    # One status email for the whole run
+    def sendReport(self):
+        '''
+        Send one email with a section per tenant (Okta errors, users, requests and rate limit waits) and per mapping (the report of oktaVboutSync for its list)
+        '''
+        allSuccess = True
+        sections = []
+        for tenantName, sync in self.tenantSyncs.items():
+            allSuccess = allSuccess and sync.all_success
+            sections.append('=== TENANT {} ===\n{}Okta users: {}\n{}{}'.format(tenantName, sync.emailBody, len(sync.oktaUsers), sync.oktaScheduler.summary(), sync.metrics.summary()))
+        for tenantName, mappingNames in self.tenants.items():
+            for mappingName in mappingNames:
+                result = self.mappingSyncs.get(mappingName)
+                if isinstance(result, oktaVboutSync):
+                    allSuccess = allSuccess and result.all_success
+                    sections.append('=== MAPPING {} (tenant {} -> VBout list {}) ===\n{}'.format(mappingName, tenantName, result.vboutListToSync, result.report()))
+                else:
+                    allSuccess = False
+                    sections.append('=== MAPPING {} (tenant {}) ===\nFAILED: {!r}\n'.format(mappingName, tenantName, result))
+
+        reporter = next(iter(self.tenantSyncs.values()), None) or oktaVboutSync(self.syncConfig(next(iter(self.tenants))), session=self.session) # SMTP settings come from [general]
+        emailSubject = "Vbout-Okta MULTI-TENANT SYNC - " + ("Success" if allSuccess else "ERROR")
+        reporter.send_email(emailSubject, '\n'.join(sections))
+
+if __name__ == '__main__' :
+    # Run "python multiTenantSync.py --full" to download every tenant in full and reset the checkpoints, e.g. after changing the excludedGroups of a mapping
+    runner = multiTenantSync()
+    runner.run(full='--full' in sys.argv)
+    runner.sendReport()
@@ -2,17 +2,455 @@
 import requests
 import json
 import configparser
+from concurrent.futures import ThreadPoolExecutor
 import logging, logging.handlers
 import smtplib, ssl
-# from datetime import datetime
+import re, time, random, threading
+import os, sys
+import sqlite3, hashlib
+import contextlib, math
+from datetime import datetime, timezone
 
-class oktaVboutSync():
+class syncMetrics():
+    '''
+    Collects the wall time of each phase of a run and, per endpoint, the number of requests, their latencies, bytes received and retries,
+    so a slow run can be traced to Okta paging, VBout reads, VBout writes or the email. Written at the end of the run with export(), either as JSON
+    or in the Prometheus text format (for the node_exporter textfile collector), and summarised in the status email with summary()
+    '''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {} # phase name -> seconds, in the order the phases ran
+        self.requests = {} # endpoint -> {'count': 0, 'latencies': [], 'bytes': 0, 'retries': 0}
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - started
+
+    def endpoint(self, name):
+        return self.requests.setdefault(name, {'count': 0, 'latencies': [], 'bytes': 0, 'retries': 0})
+
+    def recordRequest(self, name, latency, byteCount):
+        with self.lock:
+            stats = self.endpoint(name)
+            stats['count'] += 1
+            stats['latencies'].append(latency)
+            stats['bytes'] += byteCount
+
+    def recordRetry(self, name):
+        with self.lock:
+            self.endpoint(name)['retries'] += 1
+
+    def percentile(self, values, percent):
+        '''
+        Nearest-rank percentile of the received values, 0 if there are none
+        '''
+        if not values:
+            return 0
+        ordered = sorted(values)
+        return ordered[max(math.ceil(percent / 100 * len(ordered)) - 1, 0)]
+
+    def toDict(self):
+        with self.lock:
+            endpoints = {name: {'requests': stats['count'], 'retries': stats['retries'], 'bytes': stats['bytes'],
+                                'latencySeconds': {'p50': self.percentile(stats['latencies'], 50), 'p95': self.percentile(stats['latencies'], 95), 'p99': self.percentile(stats['latencies'], 99),
+                                                   'sum': sum(stats['latencies'])}}
+                         for name, stats in self.requests.items()}
+        return {'phasesSeconds': dict(self.phases), 'endpoints': endpoints}
+
+    def toPrometheus(self):
+        metrics = self.toDict()
+        lines = ['# HELP oktavboutsync_phase_seconds Wall time of each phase of the last sync run', '# TYPE oktavboutsync_phase_seconds gauge']
+        lines.extend('oktavboutsync_phase_seconds{{phase="{}"}} {:.3f}'.format(name, seconds) for name, seconds in metrics['phasesSeconds'].items())
+        lines.extend(['# HELP oktavboutsync_requests Requests sent per endpoint in the last sync run', '# TYPE oktavboutsync_requests gauge'])
+        lines.extend('oktavboutsync_requests{{endpoint="{}"}} {}'.format(name, stats['requests']) for name, stats in metrics['endpoints'].items())
+        lines.extend(['# HELP oktavboutsync_retries Requests retried per endpoint in the last sync run', '# TYPE oktavboutsync_retries gauge'])
+        lines.extend('oktavboutsync_retries{{endpoint="{}"}} {}'.format(name, stats['retries']) for name, stats in metrics['endpoints'].items())
+        lines.extend(['# HELP oktavboutsync_response_bytes Bytes received per endpoint in the last sync run', '# TYPE oktavboutsync_response_bytes gauge'])
+        lines.extend('oktavboutsync_response_bytes{{endpoint="{}"}} {}'.format(name, stats['bytes']) for name, stats in metrics['endpoints'].items())
+        lines.extend(['# HELP oktavboutsync_request_latency_seconds Request latency per endpoint in the last sync run', '# TYPE oktavboutsync_request_latency_seconds summary'])
+        for name, stats in metrics['endpoints'].items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append('oktavboutsync_request_latency_seconds{{endpoint="{}",quantile="{}"}} {:.3f}'.format(name, quantile, stats['latencySeconds'][key]))
+            lines.append('oktavboutsync_request_latency_seconds_sum{{endpoint="{}"}} {:.3f}'.format(name, stats['latencySeconds']['sum']))
+            lines.append('oktavboutsync_request_latency_seconds_count{{endpoint="{}"}} {}'.format(name, stats['requests']))
+        return '\n'.join(lines) + '\n'
+
+    def export(self, path, format):
+        '''
+        Write the metrics to the received file, "json" or "prometheus" format. Written to a temporary file first, so collectors never read a half written file
+        '''
+        content = self.toPrometheus() if format == 'prometheus' else json.dumps(self.toDict(), indent=2)
+        with open(path + '.tmp', 'w', encoding='utf-8') as metricsFile:
+            metricsFile.write(content)
+        os.replace(path + '.tmp', path)
+
+    def summary(self):
+        metrics = self.toDict()
+        lines = ['RUN METRICS:']
+        lines.extend('{}: {:.1f}s'.format(name, seconds) for name, seconds in metrics['phasesSeconds'].items())
+        for name, stats in metrics['endpoints'].items():
+            lines.append('{}: {} requests, {} retries, {:.1f} KB, latency p50 {:.2f}s / p95 {:.2f}s / p99 {:.2f}s'.format(name, stats['requests'], stats['retries'], stats['bytes'] / 1024,
+                         stats['latencySeconds']['p50'], stats['latencySeconds']['p95'], stats['latencySeconds']['p99']))
+        return '\n'.join(lines) + '\n'
+
+class oktaRequestScheduler():
+    '''
+    All Okta requests go through this scheduler. It keeps track of the rate limit budget of each endpoint from the
+    X-Rate-Limit-Limit / X-Rate-Limit-Remaining / X-Rate-Limit-Reset response headers, holds requests back when the budget is (nearly) used up,
+    and retries requests that received HTTP 429 or 5xx with exponential backoff and jitter.
+
+    waitTime is the total time (in seconds) requests spent waiting for the rate limit or for a retry, so throttling can be told apart from slow responses.
+    '''
+
+    def __init__(self, session, maxRetries=5, reserve=2, backoffBase=1.0, backoffCap=60.0):
+        self.session = session
+        self.maxRetries = maxRetries # Number of times a request that received 429/5xx (or a connection error) is retried before giving up
+        self.reserve = reserve # Requests are held back until the reset time once the remaining budget of the endpoint drops to this number, leaving room for other clients of the same org
+        self.backoffBase = backoffBase # Seconds to wait before the first retry, doubled on each further retry
+        self.backoffCap = backoffCap # Maximum number of seconds to wait between two retries
+        self.budgets = {} # Will hold the rate limit budget of each endpoint, e.g. {'/api/v1/groups/{id}/users': {'limit': 600, 'remaining': 598, 'reset': 1684312345}}
+        self.lock = threading.Lock()
+        self.waitTime = 0.0
+        self.requestCount = 0
+        self.retryCount = 0
+        self.throttledCount = 0 # Number of 429 responses received
+        self.metrics = None # Set to a syncMetrics to count the retries of each endpoint
+
+    def endpointKey(self, url):
+        '''
+        Okta rate limits are applied per endpoint, so strip the host, the query string and any object ids from the url
+        e.g. https://xxx.okta.com/api/v1/groups/00g1abcdEFGH2345ijk7/users?limit=200 -> /api/v1/groups/{id}/users
+        '''
+        path = re.sub(r'/+', '/', requests.utils.urlparse(url).path).rstrip('/')
+        return re.sub(r'/[0-9a-zA-Z]{20}(?=/|$)', '/{id}', path)
+
+    def waitForBudget(self, key):
+        '''
+        Wait until the endpoint has budget left. Requests are spread over the rest of the rate limit window once less than a quarter of the budget is left
+        '''
+        while True:
+            with self.lock:
+                budget = self.budgets.get(key)
+                now = time.time()
+                if not budget or budget['reset'] <= now:
+                    return # Budget of the endpoint is not known yet or the rate limit window has reset
+                if budget['remaining'] > self.reserve:
+                    budget['remaining'] = budget['remaining'] - 1 # Reserve a request from the budget, the real value gets set again from the response headers
+                    paced = True
+                    delay = 0
+                    if budget['remaining'] < budget['limit'] / 4:
+                        start = max(budget['nextRequest'], now)
+                        delay = start - now
+                        budget['nextRequest'] = start + (budget['reset'] - now) / max(budget['remaining'], 1) # Spread the remaining budget evenly over the rest of the window
+                    if delay <= 0:
+                        return
+                else:
+                    paced = False
+                    delay = budget['reset'] - now + random.uniform(0, 1) # Budget used up, wait for the window to reset. Jitter keeps the worker threads from all firing at the same moment
+            self.sleep(delay)
+            if paced:
+                return # Slot was already reserved before sleeping
+
+    def updateBudget(self, key, response):
+        '''
+        Record the rate limit budget of the endpoint from the response headers
+        '''
+        try:
+            limit = int(response.headers['X-Rate-Limit-Limit'])
+            remaining = int(response.headers['X-Rate-Limit-Remaining'])
+            reset = int(response.headers['X-Rate-Limit-Reset'])
+        except (KeyError, ValueError):
+            return # Endpoint does not report a rate limit
+        with self.lock:
+            budget = self.budgets.setdefault(key, {'nextRequest': 0})
+            if budget.get('reset') == reset:
+                remaining = min(remaining, budget['remaining']) # Responses of parallel requests arrive out of order, keep the lowest value seen in the same window
+            budget.update({'limit': limit, 'remaining': remaining, 'reset': reset})
+
+    def sleep(self, seconds):
+        with self.lock:
+            self.waitTime = self.waitTime + seconds
+        time.sleep(seconds)
+
+    def request(self, method, url, name=None, **kwargs):
+        '''
+        Send a request through the shared session, respecting the rate limit budget of the endpoint and retrying on 429, 5xx and connection errors.
+        Returns the last response received, which will still be an error response if all retries failed. name is the endpoint name retries are counted under in "metrics"
+        '''
+        key = self.endpointKey(url)
+        attempt = 0
+        while True:
+            self.waitForBudget(key)
+            with self.lock:
+                self.requestCount = self.requestCount + 1
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError:
+                if attempt >= self.maxRetries:
+                    raise
+                response = None
+            if response is not None:
+                self.updateBudget(key, response)
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                if attempt >= self.maxRetries:
+                    logging.error("Giving up on %s %s after %s retries, last status: %s", method, key, attempt, response.status_code)
+                    return response
+
+            delay = random.uniform(0, min(self.backoffCap, self.backoffBase * 2 ** attempt)) # Exponential backoff with full jitter
+            if response is not None and response.status_code == 429:
+                with self.lock:
+                    self.throttledCount = self.throttledCount + 1
+                try:
+                    delay = max(int(response.headers['X-Rate-Limit-Reset']) - time.time(), 0) + delay # Wait for the rate limit window to reset
+                except (KeyError, ValueError):
+                    pass
+            logging.warning("Retrying %s %s in %.1fs (status: %s)", method, key, delay, response.status_code if response is not None else 'connection error')
+            with self.lock:
+                self.retryCount = self.retryCount + 1
+            if self.metrics:
+                self.metrics.recordRetry(name or key)
+            self.sleep(delay)
+            attempt = attempt + 1
+
+    def summary(self):
+        return 'Okta requests: {}, retried: {}, throttled (429): {}, time spent waiting for the rate limit or retries: {:.1f}s\n'.format(self.requestCount, self.retryCount, self.throttledCount, self.waitTime)
+
+def redactUrl(url):
+    '''
+    Remove the VBout API key (sent as the "key" url parameter) from a url before it gets logged or stored
+    '''
+    return re.sub(r'([?&]key=)[^&]*', r'\1xxx', url)
+
+class jsonLogFormatter(logging.Formatter):
+    '''
+    Formats each log record as one JSON object per line. Request records logged by oktaVboutSync.logResponse() also carry
+    their url, status, latency, byte and item counts as separate fields (the "request" extra), so they can be filtered and aggregated without parsing the message
+    '''
+    def format(self, record):
+        entry = {'time': self.formatTime(record), 'level': record.levelname, 'message': record.getMessage()}
+        if hasattr(record, 'request'):
+            entry.update(record.request)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class oktaUser():
+    '''
+    Details of an Okta user. __slots__ keeps each record to a fixed, small size, and group names/creation dates are interned so every user in a group shares the same string.
+    Supports user['firstName'] style access, so a record can be used where a dictionary of user details was used before
+    '''
+    __slots__ = ('firstName', 'lastName', 'created', 'groups')
+
+    def __init__(self, firstName, lastName, created, groups):
+        self.firstName = firstName
+        self.lastName = lastName
+        self.created = sys.intern(created)
+        self.groups = tuple(sorted(sys.intern(groupName) for groupName in groups)) # Sorted, so the value synced to VBout does not depend on the order groups were fetched in
+
+    @property
+    def group(self):
+        return ','.join(self.groups) # Value of the VBout "Customer" field, all groups of the user
+
+    def __getitem__(self, attribute):
+        return getattr(self, attribute)
+
+    def toDict(self):
+        return {'firstName': self.firstName, 'lastName': self.lastName, 'created': self.created, 'group': self.group}
+
+class oktaMembershipStore():
+    '''
+    Okta users keyed by login (user -> oktaUser record, which holds all groups of the user), built group by group with addMember().
+    Unlike a dictionary of user details, a user in several groups keeps all of them instead of the group fetched last.
+    Behaves like a read-only dictionary of login -> oktaUser, so set(store), len(store), store[login] and login in store work as before
+    '''
 
     def __init__(self):
+        self.users = {}
+
+    def addMember(self, login, firstName, lastName, created, groupName):
+        user = self.users.get(login)
+        if user is None:
+            self.users[login] = oktaUser(firstName, lastName, created, (groupName,))
+        elif groupName not in user.groups:
+            user.groups = tuple(sorted(user.groups + (sys.intern(groupName),)))
+
+    def setUser(self, login, firstName, lastName, created, groups):
+        self.users[login] = oktaUser(firstName, lastName, created, groups)
+
+    def removeUser(self, login):
+        self.users.pop(login, None)
+
+    def toJSON(self):
+        return {login: [user.firstName, user.lastName, user.created, list(user.groups)] for login, user in self.users.items()}
+
+    @classmethod
+    def fromJSON(cls, users):
+        '''
+        Rebuild the store from toJSON() output. Also reads checkpoints saved before multi-group membership was kept ({'firstName': ..., 'group': 'oktaGroup1'})
+        '''
+        store = cls()
+        for login, user in users.items():
+            if isinstance(user, dict):
+                store.setUser(login, user['firstName'], user['lastName'], user['created'], user['group'].split(','))
+            else:
+                store.setUser(login, user[0], user[1], user[2], user[3])
+        return store
+
+    def __getitem__(self, login):
+        return self.users[login]
+
+    def get(self, login, default=None):
+        return self.users.get(login, default)
+
+    def __contains__(self, login):
+        return login in self.users
+
+    def __iter__(self):
+        return iter(self.users)
+
+    def __len__(self):
+        return len(self.users)
+
+class responseCache():
+    '''
+    On-disk cache of GET responses, stored in a SQLite file so repeated runs (and ad-hoc scripts using this class) do not download the same Okta/VBout data again.
+
+    Each endpoint has its own time to live (ttls, in seconds, e.g. {'listGroups': 3600}); endpoints without a TTL are never cached.
+    Stale entries are revalidated with If-None-Match/If-Modified-Since when the cached response had an ETag/Last-Modified header, and the least recently used
+    entries are evicted once the cache grows over maxBytes. Cache keys are a hash of the full request url, so API keys sent as url parameters are not stored in clear text
+    '''
+
+    def __init__(self, path, ttls, maxBytes):
+        self.ttls = ttls
+        self.maxBytes = maxBytes
+        self.lock = threading.Lock()
+        self.hits = 0 # Served from the cache without a request
+        self.revalidated = 0 # Stale, but the server confirmed it has not changed (HTTP 304)
+        self.misses = 0
+        self.oldestServed = {} # endpoint -> time the oldest response served from the cache (without revalidation) was stored, data older than the run itself
+        self.connection = sqlite3.connect(path, check_same_thread=False) # Shared by the worker threads, every access is guarded by self.lock
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, endpoint TEXT, url TEXT, headers TEXT, body BLOB, etag TEXT, lastModified TEXT, storedAt REAL, accessedAt REAL, size INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS responsesAccessedAt ON responses (accessedAt)')
+        self.connection.commit()
+        self.totalSize = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def key(self, url, params):
+        return hashlib.sha256(requests.Request('GET', url, params=params).prepare().url.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT headers, body, etag, lastModified, storedAt, url FROM responses WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            self.connection.execute('UPDATE responses SET accessedAt = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+        return {'headers': json.loads(row[0]), 'body': row[1], 'etag': row[2], 'lastModified': row[3], 'storedAt': row[4], 'url': row[5]}
+
+    def put(self, key, endpoint, response):
+        headers = {name: response.headers[name] for name in ('Content-Type', 'Link', 'ETag', 'Last-Modified') if name in response.headers} # Only the headers the script reads
+        url = redactUrl(response.url) # Kept for troubleshooting only, without the VBout API key
+        now = time.time()
+        with self.lock:
+            previous = self.connection.execute('SELECT size FROM responses WHERE key = ?', (key,)).fetchone()
+            self.connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                                    (key, endpoint, url, json.dumps(headers), response.content, response.headers.get('ETag'), response.headers.get('Last-Modified'), now, now, len(response.content)))
+            self.totalSize = self.totalSize + len(response.content) - (previous[0] if previous else 0)
+            while self.totalSize > self.maxBytes: # Evict the least recently used entries
+                oldest = self.connection.execute('SELECT key, size FROM responses WHERE key != ? ORDER BY accessedAt LIMIT 100', (key,)).fetchall()
+                if not oldest:
+                    break
+                self.connection.executemany('DELETE FROM responses WHERE key = ?', [(row[0],) for row in oldest])
+                self.totalSize = self.totalSize - sum(row[1] for row in oldest)
+            self.connection.commit()
+
+    def touch(self, key):
+        with self.lock:
+            self.connection.execute('UPDATE responses SET storedAt = ? WHERE key = ?', (time.time(), key))
+            self.connection.commit()
+
+    def invalidate(self, endpoint):
+        '''
+        Drop all cached responses of an endpoint, e.g. getcontacts after contacts were added or deleted
+        '''
+        with self.lock:
+            self.connection.execute('DELETE FROM responses WHERE endpoint = ?', (endpoint,))
+            self.connection.commit()
+            self.totalSize = self.connection.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+    def toResponse(self, entry):
+        '''
+        Rebuild a requests.Response from a cache entry, so callers can use .text, .json(), .links and .headers as with a live response
+        '''
+        response = requests.Response()
+        response.status_code = 200
+        response._content = entry['body']
+        response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+        response.encoding = 'utf-8'
+        response.url = entry['url']
+        return response
+
+    def request(self, endpoint, url, params, send, validate=None):
+        '''
+        Serve a GET request from the cache if the entry is fresh, otherwise call send(extraHeaders) to make the request (with conditional headers
+        when revalidating a stale entry) and store the response if it has status 200 and passes validate(response)
+        '''
+        ttl = self.ttls.get(endpoint, 0)
+        if ttl <= 0:
+            return send({})
+        key = self.key(url, params)
+        entry = self.get(key)
+        if entry and entry['storedAt'] + ttl > time.time():
+            with self.lock:
+                self.hits = self.hits + 1
+                self.oldestServed[endpoint] = min(entry['storedAt'], self.oldestServed.get(endpoint, entry['storedAt']))
+            return self.toResponse(entry)
+
+        conditionalHeaders = {}
+        if entry and entry['etag']:
+            conditionalHeaders['If-None-Match'] = entry['etag']
+        if entry and entry['lastModified']:
+            conditionalHeaders['If-Modified-Since'] = entry['lastModified']
+        response = send(conditionalHeaders)
+        if response.status_code == 304 and entry:
+            self.touch(key)
+            with self.lock:
+                self.revalidated = self.revalidated + 1
+            return self.toResponse(entry)
+        with self.lock:
+            self.misses = self.misses + 1
+        if response.status_code == 200:
+            try:
+                valid = validate is None or validate(response)
+            except (ValueError, KeyError, TypeError):
+                valid = False
+            if valid:
+                self.put(key, endpoint, response)
+        return response
+
+    def summary(self):
+        oldest = ''
+        if self.oldestServed:
+            oldest = ', oldest response served was cached {:.0f} minutes ago'.format((time.time() - min(self.oldestServed.values())) / 60)
+        return 'Response cache: {} hits, {} revalidated, {} misses{}, {:.1f} MB on disk\n'.format(self.hits, self.revalidated, self.misses, oldest, self.totalSize / 1048576)
+
+class oktaVboutSync():
+
+    def __init__(self, config=None, session=None, oktaScheduler=None):
+        '''
+        config defaults to config.ini. A runner syncing several tenants/lists (multiTenantSync.py) passes the config of each mapping and shares its session,
+        and the Okta request scheduler of the tenant, between the instances
+        '''
 
         # Read configuration parameters
-        config = configparser.RawConfigParser() # RawConfigParser sets interpolation to none so any % characters in the URLs can work
-        config.read('config.ini')
+        if config is None:
+            config = configparser.RawConfigParser() # RawConfigParser sets interpolation to none so any % characters in the URLs can work
+            config.read('config.ini')
         self.oktaApiKey = config['general']['oktaApiKey']
         self.vboutApiKey = config['general']['vboutApiKey']
         self.vboutUrl = config['general']['vboutUrl']
@@ -20,12 +458,55 @@ class oktaVboutSync():
         self.oktaLimit = config['general']['oktaLimit']  # Number of users Okta API will return. Max allowed is 200. If there are more users, "link" header will include the URL to the next page
         self.excludedGroups = config['general']['excludedGroups']  # Okta groups that will not be added to VBout
         self.vboutListToSync = config['general']['vboutListToSync'] # Okta users will be added/deleted to/from this list on Vbout Contacts page
+        self.oktaConcurrency = config.getint('general', 'oktaConcurrency', fallback=1) # Number of Okta groups whose members are fetched in parallel. 1 fetches the groups one after another
+        self.syncMode = config.get('general', 'syncMode', fallback='full') # "full" fetches every group member, "incremental" only fetches users changed since the last run (see checkpointFile)
+        self.checkpointFile = config.get('general', 'checkpointFile', fallback='checkpoint.json') # Time of the last sync and the Okta users found on that run, saved after each successful run
+
+        # Logging: "logFormat = json" writes one JSON record per line. Response bodies are only logged at DEBUG level, for a "logBodySampleRate" share of responses and cut to "logBodyLimit" characters
+        self.logBodyLimit = config.getint('general', 'logBodyLimit', fallback=2000)
+        self.logBodySampleRate = config.getfloat('general', 'logBodySampleRate', fallback=0.01)
+        self.logger.setLevel(config.get('general', 'logLevel', fallback='INFO').upper())
+        if config.get('general', 'logFormat', fallback='text') == 'json':
+            self.handler.setFormatter(jsonLogFormatter())
+        self.logger.info('Starting oktaVboutSync.py, syncing VBout list %s', self.vboutListToSync) # Logged once the formatter is set, so the first line of a JSON log is JSON too
+
+        # One keep-alive session shared by all requests (and all worker threads), so TCP/TLS connections get reused instead of being opened for every call
+        self.session = session
+        if self.session is None:
+            self.session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=2, pool_maxsize=max(self.oktaConcurrency, 10))
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+        self.metrics = syncMetrics()
+        self.oktaScheduler = oktaScheduler
+        if self.oktaScheduler is None:
+            self.oktaScheduler = oktaRequestScheduler(self.session, maxRetries=config.getint('general', 'oktaMaxRetries', fallback=5), reserve=config.getint('general', 'oktaRateLimitReserve', fallback=2))
+            self.oktaScheduler.metrics = self.metrics
+        self.metricsFile = config.get('general', 'metricsFile', fallback='') # Phase timings and per-endpoint request metrics are written here at the end of the run, leave empty to disable
+        self.metricsFormat = config.get('general', 'metricsFormat', fallback='json') # "json" or "prometheus" (text format for the node_exporter textfile collector)
+
+        # Optional on-disk response cache, disabled if cacheFile is empty. cacheTTL sets the seconds each endpoint's responses stay fresh, e.g. listGroups:3600,listGroupMembers:900,getlists:3600
+        # A getcontacts TTL only applies within a run: contacts cached by an earlier run would hide the changes still to be made, so the run would plan nothing and still report success
+        self.cache = None
+        if config.get('general', 'cacheFile', fallback=''):
+            cacheTTLs = {}
+            for endpointTTL in config.get('general', 'cacheTTL', fallback='').split(','):
+                if ':' in endpointTTL:
+                    endpoint, ttl = endpointTTL.split(':')
+                    cacheTTLs[endpoint.strip()] = int(ttl)
+            self.cache = responseCache(config.get('general', 'cacheFile'), cacheTTLs, config.getint('general', 'cacheMaxMB', fallback=200) * 1048576)
+            self.cache.invalidate('getcontacts')
 
         self.groups = [] # Will be a list that holds a dictionary of groups. Each group dictionary will have an group id, name and group creation date
 
         # updateTime = "Last updated on: " + datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S.%f')[:-7]+' GMT' # record the GMT time the script was run at
-        self.vboutApiLimit = 1000000 # api default is to return 100 results. Setting a high limit so all results are returned 
-        self.oktaUsers = {} # Will hold user details in a dictionary, where email will be the main key
+        self.vboutPageSize = config.getint('general', 'vboutPageSize', fallback=1000) # Number of lists/contacts requested from VBout per page
+        self.vboutPageConcurrency = config.getint('general', 'vboutPageConcurrency', fallback=4) # Number of VBout pages requested in parallel
+        self.vboutComplete = True # Cleared if any VBout page could not be read
+        self.vboutWriteWorkers = config.getint('general', 'vboutWriteWorkers', fallback=4) # Number of VBout add/delete requests sent in parallel
+        self.planFile = config.get('general', 'planFile', fallback='plan.jsonl') # VBout changes computed by the plan phase, applied by the apply phase. Applied operations are recorded in planFile + ".done" so an interrupted apply can be resumed
+        self.vboutWriteCounts = {'add': {'succeeded': 0, 'failed': 0}, 'update': {'succeeded': 0, 'failed': 0}, 'delete': {'succeeded': 0, 'failed': 0}}
+        self.oktaUsers = oktaMembershipStore() # Will hold user details (and all groups of each user), where email will be the main key
         self.vboutContacts = {} # Will hold user details in a dictionary, where email will be the main key
         self.vboutOktaListID = ''
         self.vboutOktaListFields = {}
@@ -37,14 +518,20 @@ class oktaVboutSync():
 
         self.smtpHost = config.get("general", "smtpHost")
         self.smtpPort = config.getint("general", "smtpPort")
+        self.smtpSsl = config.getboolean("general", "smtpSsl", fallback=True) # Set to false for a plain SMTP server, e.g. a local relay or the benchmark's SMTP sink
         self.smtpUser = config.get("general", "smtpUser")
         self.smtpPassword = config.get("general", "smtpAppPassword")
         self.recipients = config.get("general", "recipients").split(',') # Convert the emails into a list
         self.emailBody = ""
         self.all_success = True # Flag to monitor if any errors are received, initially set to True
+        self.oktaComplete = True # Cleared if any Okta request failed, so contacts are not deleted from VBout because of missing Okta data
+        self.reportLock = threading.Lock() # Worker threads update the email body and the flags above through reportError()
         self.successfullyAddedUsers = 'USERS ADDED:\n'
+        self.successfullyUpdatedUsers = 'USERS UPDATED:\n'
         self.successfullyDeletedUsers = 'USERS DELETED:\n'
 
+    oktaEndpoints = ('listGroups', 'listGroupMembers', 'listUsers', 'getLogs', 'getUser', 'listUserGroups') # Names the Okta requests are logged, counted and cached under
+
     # Setting up logger
     logger = logging.getLogger()
     logging.getLogger("chardet.charsetprober").disabled = True # Disable chardet encoding errors on the logs
@@ -52,144 +539,396 @@ class oktaVboutSync():
     handler = logging.handlers.TimedRotatingFileHandler(filename='logs/oktaVboutSync.log', when='midnight', interval=1, backupCount=0,encoding='utf-8', delay=False, utc=False) # Make sure encoding is set to utf-8 as axiory response is causing encoding errors
     handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s: %(message)s'))
     logger.addHandler(handler)
-    logging.info('Starting oktaVboutSync.py')
 
-    # Get All Groups in Okta
-    def listGroups(self):
+    # Log and count a request
+    def logResponse(self, name, response, itemCount=None):
         '''
-        Get all Okta Groups. 
+        Record the latency and size of the request in "metrics" (responses served from the cache are not counted), and log one record per request with the url (without the API key), status, latency, response size and number of items received.
+        The full body is only logged at DEBUG level for a sample of the responses, truncated to "logBodyLimit" characters
+        '''
+        if response.request is not None:
+            self.metrics.recordRequest(name, response.elapsed.total_seconds(), len(response.content))
+        if self.logger.isEnabledFor(logging.INFO):
+            request = {'endpoint': name, 'method': response.request.method if response.request else 'GET', 'url': redactUrl(response.url), 'status': response.status_code,
+                       'latencyMs': round(response.elapsed.total_seconds() * 1000, 1), 'bytes': len(response.content), 'items': itemCount}
+            self.logger.info("%s %s %s status=%s latency=%sms bytes=%s items=%s", name, request['method'], request['url'], request['status'], request['latencyMs'], request['bytes'], itemCount, extra={'request': request})
+        if self.logger.isEnabledFor(logging.DEBUG) and random.random() < self.logBodySampleRate:
+            self.logger.debug("%s response body (%s of %s characters): %s", name, min(len(response.text), self.logBodyLimit), len(response.text), response.text[:self.logBodyLimit])
 
-        "link" header will include a "rel=next" parameter if there is a next page
-        e.g. <https://${yourOktaDomain}/api/v1/users?after=00abcYZLMRWLUWIEDKK>; rel="next"
-        If there are no other pages, link header will return "rel=self" 
+    # Report an error in the status email
+    def reportError(self, message):
+        with self.reportLock:
+            self.all_success = False
+            self.emailBody = self.emailBody + message
 
-        listGroups endpoint:   {{url}}/api/v1/groups
+    # Get all pages of an Okta list endpoint
+    def getOktaPages(self, url, logName, allowNotFound=False):
         '''
-        link = '"next"' # Continue making requests if the "Link" header has ref="next"
-
-        url = self.oktaUrl + "/api/v1/groups/"
-        self.logger.info("listGroups request url: {}".format(url))
+        Request an Okta list endpoint through the request scheduler and yield the parsed body of each page.
+        With allowNotFound, a 404 (e.g. a user deleted from Okta) yields None instead of being reported as incomplete Okta data
 
+        "link" header will include a "rel=next" parameter if there is a next page
+        e.g. <https://${yourOktaDomain}/api/v1/users?after=00abcYZLMRWLUWIEDKK>; rel="next"
+        If there are no other pages, link header will only return "rel=self"
+        '''
         payload = ""
         headers = {
             'Accept': "application/json",
             'Content-Type': "application/json",
             'Authorization': "SSWS " + self.oktaApiKey
             }
+        params = {'limit': self.oktaLimit}
 
-        while (link == '"next"'):
-            self.logger.info("Link header ref={}".format(link))
-
-            response = requests.request("GET", url, data=payload, headers=headers)
+        while url:
+            send = lambda extraHeaders: self.oktaScheduler.request("GET", url, name=logName, data=payload, headers=dict(headers, **extraHeaders), params=params)
+            response = self.cache.request(logName, url, params, send) if self.cache else send({})
+            if response.status_code == 404 and allowNotFound:
+                self.logResponse(logName, response)
+                yield None
+                return
+            if response.status_code != 200:
+                self.oktaComplete = False
+                self.reportError('Okta ' + logName + ' request failed, Okta data is incomplete so no contacts were deleted from VBout. \nOkta request url: ' + url + ' \nReceived status: ' + str(response.status_code) + ' \nReceived response: ' + response.text[:self.logBodyLimit] + '\n')
+                return
             responseJSON = json.loads(response.text)
-            self.logger.info("listGroups response body: {}".format(responseJSON))
+            self.logResponse(logName, response, len(responseJSON) if isinstance(responseJSON, list) else None)
+            yield responseJSON
+
+            url = response.links.get('next', {}).get('url') # Next page url already includes the limit and the cursor
+            params = None
+
+    # Get All Groups in Okta
+    def listGroups(self):
+        '''
+        Get all Okta Groups. 
+
+        listGroups endpoint:   {{url}}/api/v1/groups
+        '''
+        url = self.oktaUrl + "/api/v1/groups/"
+        self.logger.info("listGroups request url: %s", url)
 
+        for responseJSON in self.getOktaPages(url, 'listGroups'):
             for group in responseJSON:
                 eachGroup = {}
                 eachGroup['name'] = group['profile']['name']
                 eachGroup['id'] = group['id']
                 self.groups.append(eachGroup)   ## Add to the "groups" (list) attribute
 
-            self.logger.info("listGroups response headers: {}".format(response.headers))
-            link = response.headers['Link'].split('rel=') # <https://xxxxxxxxx.okta.com/api/v1/groups?limit=10000>; rel="self". link will be '"next"' if there is more data to be requested
-
     # Get Users in an Okta Group
     def getOktaGroupMembers(self, groupName, groupId):
         '''
-        Get Okta group members
+        Get Okta group members and add them to the "oktaUsers" attribute
+        '''
+        for login, firstName, lastName, created in self.fetchOktaGroupMembers(groupName, groupId):
+            self.oktaUsers.addMember(login, firstName, lastName, created, groupName)
+
+    def fetchOktaGroupMembers(self, groupName, groupId):
+        '''
+        Get Okta group members and return them in a list of (login, firstName, lastName, created) tuples. Does not modify "oktaUsers", so it is safe to call from worker threads
 
-        "link" header will include a "rel=next" parameter if there is a next page
-        e.g. <https://${yourOktaDomain}/api/v1/users?after=00abcYZLMRWLUWIEDKK>; rel="next"
-        If there are no other pages, link header will return "rel=self" 
-        
         listGroupMemmbers endpoint:  {{url}}/api/v1/groups/{{groupId}}/users
         '''
-        link = '"next"' # Continue making requests if the "Link" header has ref="next"   
+        members = []
 
         url = self.oktaUrl + "/api/v1/groups/" + groupId + "/users"
-        self.logger.info("listGroupMembers request url: {}".format(url))
-        
+        self.logger.info("listGroupMembers request url: %s", url)
+
+        for responseJSON in self.getOktaPages(url, 'listGroupMembers'):
+            for user in responseJSON:
+                if (user['status'] != "DEPROVISIONED"):                   
+                    members.append((user['profile']['login'], user['profile']['firstName'], user['profile']['lastName'], user['created'].split('T')[0]))
+
+        return members
+
+    # Get Users in all Okta Groups, several groups at a time
+    def getAllOktaGroupMembers(self, groups):
+        '''
+        Get the members of all received groups ([{'name': 'oktaGroup1', 'id': '00g1...'}, ...]) using a pool of "oktaConcurrency" worker threads sharing the same session.
+        Results are merged into "oktaUsers" in the order of the received groups, so the result is the same as in a sequential run. A user in several groups keeps all of them
+        '''
+        with ThreadPoolExecutor(max_workers=max(self.oktaConcurrency, 1)) as executor:
+            results = executor.map(lambda group: self.fetchOktaGroupMembers(group['name'], group['id']), groups) # map() returns the results in the order of "groups", whichever request finishes first
+            for group, members in zip(groups, results):
+                print("Got {} members of Okta group: {}".format(len(members), group['name']))
+                for login, firstName, lastName, created in members:
+                    self.oktaUsers.addMember(login, firstName, lastName, created, group['name'])
+
+    # Load the checkpoint saved by the previous run
+    def loadCheckpoint(self):
+        '''
+        Load the checkpoint file. Returns None if there is no usable checkpoint, in which case a full sync has to be run
+        Checkpoint format: {'lastSync': '2023-05-20T08:00:00.000Z', 'users': {'user@company.com': ['User', 'User', '2023-01-01', ['oktaGroup1', 'oktaGroup2']], ...}}
+        '''
+        try:
+            with open(self.checkpointFile, encoding='utf-8') as checkpointFile:
+                checkpoint = json.load(checkpointFile)
+        except (OSError, ValueError) as e:
+            self.logger.info("No usable checkpoint in %s, running a full sync: %s", self.checkpointFile, e)
+            return None
+        if 'lastSync' not in checkpoint or 'users' not in checkpoint:
+            self.logger.info("Checkpoint in %s is not in the expected format, running a full sync", self.checkpointFile)
+            return None
+        return checkpoint
+
+    # Save the checkpoint for the next incremental run
+    def saveCheckpoint(self, syncStart):
+        '''
+        Save the start time of this run and the current Okta users. The start time (rather than the end time) is saved so changes made in Okta while the script was running get picked up by the next run.
+        If any Okta response was served from the response cache, the time the oldest of them was stored is saved instead, so the next run also picks up the changes the cached data missed
+        '''
+        lastSync = syncStart
+        if self.cache:
+            servedAt = [self.cache.oldestServed[endpoint] for endpoint in self.oktaEndpoints if endpoint in self.cache.oldestServed]
+            if servedAt:
+                lastSync = min(lastSync, datetime.fromtimestamp(min(servedAt), timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z'))
+        tempFile = self.checkpointFile + '.tmp'
+        with open(tempFile, 'w', encoding='utf-8') as checkpointFile:
+            json.dump({'lastSync': lastSync, 'users': self.oktaUsers.toJSON()}, checkpointFile, separators=(',', ':'))
+        os.replace(tempFile, self.checkpointFile) # Replace the old checkpoint in one step, so a crash while writing does not leave a half written checkpoint
+        self.logger.info("Saved checkpoint with %s users to %s", len(self.oktaUsers), self.checkpointFile)
+
+    # Get Okta users whose profile or status changed since the last sync
+    def getChangedOktaUsers(self, since):
+        '''
+        Get the users updated since the received time (profile or status changes, e.g. deactivated users), as a dictionary of user id -> login
+
+        listUsers endpoint:  {{url}}/api/v1/users?search=lastUpdated gt "2023-05-20T08:00:00.000Z"
+        '''
+        url = self.oktaUrl + "/api/v1/users?search=" + requests.utils.quote('lastUpdated gt "' + since + '"')
+        self.logger.info("listUsers request url: %s", url)
+
+        userIds = {}
+        for responseJSON in self.getOktaPages(url, 'listUsers'):
+            for user in responseJSON:
+                userIds[user['id']] = user['profile']['login']
+        return userIds
+
+    # Get Okta users and groups changed since the last sync, from the System Log
+    def getOktaLogChanges(self, since):
+        '''
+        Get the users and groups changed since the received time from the System Log. Returns (user id -> login (the alternateId of the event target), [group ids]):
+        - users added to or removed from any group, deactivated or deleted. Deleted users no longer show up in the listUsers search and deactivated users keep their group memberships,
+          so without these events a user deactivated and then deleted between two runs would never be removed
+        - groups whose profile was updated (e.g. renamed), as the "group" field of all their members has to be updated
+
+        System Log endpoint:  {{url}}/api/v1/logs?since=2023-05-20T08:00:00.000Z&filter=eventType eq "group.user_membership.add" or eventType eq "group.user_membership.remove" or ...
+        '''
+        eventTypes = ('group.user_membership.add', 'group.user_membership.remove', 'user.lifecycle.deactivate', 'user.lifecycle.delete.initiated', 'group.profile.update')
+        url = self.oktaUrl + "/api/v1/logs?since=" + requests.utils.quote(since) + "&filter=" + requests.utils.quote(' or '.join('eventType eq "' + eventType + '"' for eventType in eventTypes))
+        self.logger.info("getLogs request url: %s", url)
+
+        userIds = {}
+        groupIds = []
+        for responseJSON in self.getOktaPages(url, 'getLogs'):
+            if not responseJSON:
+                break # The System Log always returns a "next" link for polling, an empty page means all events were received
+            for event in responseJSON:
+                for target in event.get('target') or []:
+                    if target['type'] == 'User':
+                        userIds[target['id']] = target.get('alternateId')
+                    elif target['type'] == 'UserGroup' and event.get('eventType') == 'group.profile.update' and target['id'] not in groupIds:
+                        groupIds.append(target['id'])
+        return userIds, groupIds
+
+    # Get the ids of the members of an Okta group
+    def getOktaGroupMemberIds(self, groupId):
+        '''
+        Get the members of a group as a dictionary of user id -> login, e.g. to re-fetch every member of a renamed group
+
+        listGroupMembers endpoint:  {{url}}/api/v1/groups/{{groupId}}/users
+        '''
+        userIds = {}
+        for responseJSON in self.getOktaPages(self.oktaUrl + "/api/v1/groups/" + groupId + "/users", 'listGroupMembers'):
+            for user in responseJSON:
+                userIds[user['id']] = user['profile']['login']
+        return userIds
+
+    # Get the current details and groups of a single Okta user
+    def fetchOktaUser(self, userId, login, includedGroupNames):
+        '''
+        Get a user and the synced groups it belongs to. Returns (login, (firstName, lastName, created, groups)) or (login, None) if the user is deprovisioned, not a member of any synced group
+        or was deleted from Okta (404, the received login of the user is removed then)
+
+        getUser endpoint:        {{url}}/api/v1/users/{{userId}}
+        listUserGroups endpoint: {{url}}/api/v1/users/{{userId}}/groups
+        '''
+        user = next(self.getOktaPages(self.oktaUrl + "/api/v1/users/" + userId, 'getUser', allowNotFound=True), False)
+        if user is False:
+            return None, None # Request failed, already reported by getOktaPages
+        if user is None:
+            return login, None # Deleted from Okta since the last sync
+
+        userGroups = []
+        for responseJSON in self.getOktaPages(self.oktaUrl + "/api/v1/users/" + userId + "/groups", 'listUserGroups', allowNotFound=True):
+            if responseJSON is None:
+                return user['profile']['login'], None # Deleted from Okta while this run was fetching it
+            userGroups.extend(group['profile']['name'] for group in responseJSON if group['profile']['name'] in includedGroupNames)
+
+        if user['status'] == "DEPROVISIONED" or not userGroups:
+            return user['profile']['login'], None
+        return user['profile']['login'], (user['profile']['firstName'], user['profile']['lastName'], user['created'].split('T')[0], userGroups)
+
+    # Update the Okta users of the last run with the changes made since
+    def getIncrementalOktaChanges(self, checkpoint, groups):
+        '''
+        Start from the users saved in the checkpoint and only fetch the users that changed since the checkpoint was saved:
+        users updated since then (getChangedOktaUsers), users added to/removed from a group, deactivated or deleted, and every member of a group that was renamed (getOktaLogChanges).
+        The add/delete delta against VBout is then computed from "oktaUsers" the same way as after a full sync
+        '''
+        self.oktaUsers = oktaMembershipStore.fromJSON(checkpoint['users'])
+        includedGroupNames = {group['name'] for group in groups}
+
+        changedUsers = self.getChangedOktaUsers(checkpoint['lastSync'])
+        logUsers, updatedGroupIds = self.getOktaLogChanges(checkpoint['lastSync'])
+        for groupId in updatedGroupIds:
+            logUsers.update(self.getOktaGroupMemberIds(groupId))
+        for userId, login in logUsers.items():
+            changedUsers[userId] = changedUsers.get(userId) or login # One entry per user, keep the order
+        print("{} Okta users changed since {}".format(len(changedUsers), checkpoint['lastSync']))
+
+        with ThreadPoolExecutor(max_workers=max(self.oktaConcurrency, 1)) as executor:
+            for login, userDetails in executor.map(lambda changedUser: self.fetchOktaUser(changedUser[0], changedUser[1], includedGroupNames), changedUsers.items()):
+                if login is None:
+                    continue
+                if userDetails is None:
+                    self.oktaUsers.removeUser(login)
+                else:
+                    self.oktaUsers.setUser(login, *userDetails)
+
+    # Get one page of a VBout list endpoint
+    def getVboutPage(self, endpoint, params, collection, page):
+        '''
+        Request a single page of a VBout list endpoint. Returns the collection ({"count": total number of items, "items": [items on the page]}), or None if the response is not in the expected format
+        e.g. getcontacts returns {"response": {"header": {...}, "data": {"contacts": {"count": 2, "items": [{...}, {...}]}}}}
+        '''
+        url = self.vboutUrl + "emailmarketing/" + endpoint
+        pageParams = dict(params, key=self.vboutApiKey, limit=self.vboutPageSize, page=page)
+
         payload = ""
         headers = {
             'Accept': "application/json",
-            'Content-Type': "application/json",
-            'Authorization': "SSWS " + self.oktaApiKey
+            'Content-Type': "application/json"
             }
 
-        while (link == '"next"'):
-            response = requests.request("GET", url, data=payload, headers=headers)
-            responseJSON = json.loads(response.text)
-            self.logger.info("listGroupMembers response body: {}".format(responseJSON))
+        send = lambda extraHeaders: self.session.request("GET", url, data=payload, headers=dict(headers, **extraHeaders), params=pageParams)
+        if self.cache:
+            response = self.cache.request(endpoint.split('.')[0], url, pageParams, send, validate=lambda response: collection in response.json()['response']['data']) # Do not cache error responses
+        else:
+            response = send({})
+        try:
+            responseJSON = response.json()['response']
+            items = responseJSON['data'][collection]['items']
+            count = int(responseJSON['data'][collection]['count'])
+        except (ValueError, KeyError, TypeError):
+            self.reportError('Response received from VBout ' + endpoint + ' request is not in the expected format. \nVbout ' + endpoint + ' request url: ' + url + ' (page ' + str(page) + ') \nReceived response: ' + response.text[:self.logBodyLimit] + ' \nExpected a "data" and then a "' + collection + '" attribute with "count" and "items"\n')
+            return None
+        self.logResponse(endpoint, response, len(items))
+        return {'count': count, 'items': items}
 
-            for user in responseJSON:
-                if (user['status'] != "DEPROVISIONED"):                   
-                    if (user['status'] != "DEPROVISIONED"): 
-                        eachUser = {'firstName':user['profile']['firstName'], 'lastName':user['profile']['lastName'], 'created':user['created'].split('T')[0], 'group':groupName}
-                        self.oktaUsers[user['profile']['login']] = eachUser
-            self.logger.info("listGroups response headers: {}".format(response.headers))
-            link = response.headers['Link'].split('rel=') # <https://xxxxxxxxxxxxx.okta.com/api/v1/groups?limit=10000>; rel="self". link will be '"next"' if there is more data to be requested
+    # Get all items of a VBout list endpoint, page by page
+    def iterVboutItems(self, endpoint, params, collection):
+        '''
+        Generator yielding the items of a VBout list endpoint page by page, so the whole result never has to be held in memory (or in a single response).
+        Page 1 tells the total number of items ("count"), the remaining pages are then requested "vboutPageConcurrency" at a time; the items are still yielded in page order.
+        Should "count" turn out to be less than the total, pages keep being requested one by one for as long as the last one comes back full.
+        "vboutComplete" is cleared if a page could not be read or the number of items received differs from "count"
+        '''
+        firstPage = self.getVboutPage(endpoint, params, collection, 1)
+        if firstPage is None:
+            self.vboutComplete = False
+            return
+        yield from firstPage['items']
+        received = len(firstPage['items'])
+        lastPage = max(math.ceil(firstPage['count'] / self.vboutPageSize), 2 if received == self.vboutPageSize else 1)
+
+        window = max(self.vboutPageConcurrency, 1)
+        nextPage = 2
+        with ThreadPoolExecutor(max_workers=window) as executor:
+            pending = [] # (page number, future) of the pages requested but not yielded yet, in page order
+            while pending or nextPage <= lastPage:
+                while len(pending) < window and nextPage <= lastPage:
+                    pending.append((nextPage, executor.submit(self.getVboutPage, endpoint, params, collection, nextPage)))
+                    nextPage = nextPage + 1
+                pageNumber, future = pending.pop(0)
+                page = future.result()
+                if page is None:
+                    self.vboutComplete = False
+                    break
+                yield from page['items']
+                received = received + len(page['items'])
+                if pageNumber == lastPage and len(page['items']) == self.vboutPageSize:
+                    lastPage = lastPage + 1 # Last page was full, there may be more
+            for pageNumber, future in pending:
+                future.cancel() # Pages not started yet after a page that could not be read
+
+        if self.vboutComplete and received != firstPage['count']:
+            self.vboutComplete = False
+            self.reportError('VBout ' + endpoint + ' returned ' + str(received) + ' items but reported a count of ' + str(firstPage['count']) + ', VBout data may be incomplete so no contacts were added.\n')
 
     # Get currnet lists on VBout
     def getVboutLists(self):
         '''
         Get VBout lists to find the id of OktaUsers list and fetch the ids of it's fields
 
-        Lists endpoint:  https://api.vbout.com/1/emailmarketing/getlists.json?key=xxxxxxxxxxxxxx
+        Lists endpoint:  https://api.vbout.com/1/emailmarketing/getlists.json?key=xxxxxxxxxxxxxx&limit=1000&page=1
         '''  
+        self.logger.info("vbout getlists request url: %s", self.vboutUrl + "emailmarketing/getlists.json")
 
-        url = self.vboutUrl + "emailmarketing/getlists.json?key=" + self.vboutApiKey + '&limit=' + str(self.vboutApiLimit)
-        self.logger.info("vbout getlists request url: {}".format(url))
-        
-        payload = ""
-        headers = {
-            'Accept': "application/json",
-            'Content-Type': "application/json"
-            }
-
-        response = requests.request("GET", url, data=payload, headers=headers)
-        responseJSON = json.loads(response.text)['response']
-        self.logger.info("VBout Lists response body: {}".format(responseJSON))
+        oktaListNotFound = True
+        for eachList in self.iterVboutItems("getlists.json", {}, 'lists'):
+            if (eachList['name'] == self.vboutListToSync):
+                oktaListNotFound = False # Clear the flag as the Okta list is found
+                self.vboutOktaListID = eachList['id']
+                self.vboutOktaListFields = eachList['fields']
+                key_list = list(self.vboutOktaListFields.keys())
+                val_list = list(self.vboutOktaListFields.values())
 
-        if('data' in responseJSON and 'lists' in responseJSON['data'] and 'items' in responseJSON['data']['lists']):
-            if(responseJSON['data']['lists']['count'] >= self.vboutApiLimit):
-                print("ERROR there might be more lists that the API has not returned, check the limit parameter supplied")
-                self.all_success = False # response is not in the expected structure
-                self.emailBody = self.emailBody + 'Received lists count is equal to the limit parameter supplied to the getlists request, so script might have not received all VBout lists. Check the limit parameter used. \nVbout getlists request url: ' + url + ' \nReceived response: ' +  response.text
-            else:
-                vboutLists = responseJSON['data']['lists']['items']
-                oktaListNotFound = True
-                for eachList in vboutLists:
-                    if (eachList['name'] == self.vboutListToSync):
-                        oktaListNotFound = False # Clear the flag as the Okta list is found
-                        self.vboutOktaListID = eachList['id']
-                        self.vboutOktaListFields = eachList['fields']
-                        key_list = list(self.vboutOktaListFields.keys())
-                        val_list = list(self.vboutOktaListFields.values())
-    
-                        self.vboutFirstNameFieldID = key_list[val_list.index('First Name')]
-                        self.vboutLastNameFieldID = key_list[val_list.index('Last Name')]
-                        self.vboutEmailFieldID = key_list[val_list.index('Email Address')]
-                        self.vboutCustomerFieldID = key_list[val_list.index('Customer')]
-                        self.vboutActivatedFieldID = key_list[val_list.index('Activated')]
-                        self.logger.info("vbout getlists response headers: {}".format(response.headers))
-                        self.getVboutContacts(self.vboutOktaListID)
-                if(oktaListNotFound):
-                    self.all_success = False # Okta Users list is not found in the vbout getlists response
-                    self.emailBody = self.emailBody + 'Response received from VBout getlists does not include the' + self.vboutListToSync + 'list. \nVBout getlists request url: ' + url + ' \nReceived response: ' +  response.text
-        else:
-            self.all_success = False # response is not in the expected structure
-            self.emailBody = self.emailBody + 'Response received from VBout getlists request is not in the expected format. \nVbout getlists request url: ' + url + ' \nReceived response: ' +  response.text + ' \nExpected a "data" and then a "lists" attribute'
+                self.vboutFirstNameFieldID = key_list[val_list.index('First Name')]
+                self.vboutLastNameFieldID = key_list[val_list.index('Last Name')]
+                self.vboutEmailFieldID = key_list[val_list.index('Email Address')]
+                self.vboutCustomerFieldID = key_list[val_list.index('Customer')]
+                self.vboutActivatedFieldID = key_list[val_list.index('Activated')]
+                self.getVboutContacts(self.vboutOktaListID)
+        if(oktaListNotFound and self.vboutComplete):
+            self.vboutComplete = False # No list to write to, so no adds are planned
+            self.reportError('Response received from VBout getlists does not include the ' + self.vboutListToSync + ' list.\n')
 
     # Get VBout Contacts in a List
     def getVboutContacts(self, id):
         '''
-        Get VBout contacts that are in the Okta Users lists. API returns a max of 100 contacts. Check the count 
+        Get VBout contacts that are in the Okta Users lists, "vboutPageSize" contacts per request.
+        Only the contact id (needed to update/delete the contact) and the values of the fields synced from Okta are kept for each contact,
+        e.g. {'user@company.com': {'id': '14523', 'firstName': 'User', 'lastName': 'User', 'group': 'oktaGroup1', 'created': '2023-01-01'}}
+        A field missing from the getcontacts response is left out, so it is not seen as changed
 
-        getcontacts endpoint:  https://api.vbout.com/1/emailmarketing/getcontacts.json?key=xxxxxxxxxxxxx&listid=97396
+        getcontacts endpoint:  https://api.vbout.com/1/emailmarketing/getcontacts.json?key=xxxxxxxxxxxxx&listid=97396&limit=1000&page=1
         '''  
+        self.logger.info("vbout getcontacts request url: %s?listid=%s", self.vboutUrl + "emailmarketing/getcontacts.json", id)
+
+        syncedFields = {'firstName': str(self.vboutFirstNameFieldID), 'lastName': str(self.vboutLastNameFieldID), 'group': str(self.vboutCustomerFieldID), 'created': str(self.vboutActivatedFieldID)}
+        for eachUser in self.iterVboutItems("getcontacts.json", {'listid': id}, 'contacts'):
+            contactFields = {str(fieldID): value for fieldID, value in (eachUser.get('fields') or {}).items()}
+            eachContact = {'id': eachUser['id']}
+            for attribute, fieldID in syncedFields.items():
+                if fieldID in contactFields:
+                    eachContact[attribute] = contactFields[fieldID]
+            self.vboutContacts[eachUser['email']] = eachContact
+        print("Got {} VBout contacts".format(len(self.vboutContacts)))
+
+    # Add Contacts to VBout
+    def addVboutContact(self, userEmail, userDetails, listID):
+        '''
+        Add a contact to the Vbout List with the received id
+        Expected userDetails parameter format: {'user@company.com': {'firstName': 'User', 'lastName': 'User', 'group': 'oktaGroup1'}, 'user.second@acy.com': {'firstName': 'User', 'lastName': 'Second', 'group': 'oktaGroupX'}, ... }
 
-        url = self.vboutUrl + "emailmarketing/getcontacts.json?key=" + self.vboutApiKey + '&listid=' + id + '&limit=' + str(self.vboutApiLimit)
-        self.logger.info("vbout getcontacts request url: {}".format(url))
+        addcontact endpoint:  POST https://api.vbout.com/1/emailmarketing/addcontact.json?key={YOUR_API_ID} email=info@example.com status=active listid=24 fields[125]=John fields[1204]=Doe fields[325]=1983-9-1
+        '''  
+
+        url = self.vboutUrl + "emailmarketing/addcontact.json"
+        params = {'key': self.vboutApiKey, 'email': userEmail, 'status': 'active', 'listid': listID,
+                  'fields[' + str(self.vboutFirstNameFieldID) + ']': userDetails['firstName'], 'fields[' + str(self.vboutLastNameFieldID) + ']': userDetails['lastName'],
+                  'fields[' + str(self.vboutCustomerFieldID) + ']': userDetails['group'], 'fields[' + str(self.vboutActivatedFieldID) + ']': userDetails['created'],
+                  'fields[' + str(self.vboutEmailFieldID) + ']': userEmail} # Sent as params so requests encodes values such as "user+tag@company.com" or "Smith & Sons"
         
         payload = ""
         headers = {
@@ -197,56 +936,57 @@ class oktaVboutSync():
             'Content-Type': "application/json"
             }
 
-        response = requests.request("GET", url, data=payload, headers=headers)
+        response = self.session.request("POST", url, data=payload, headers=headers, params=params)
         responseJSON = json.loads(response.text)['response']
-        self.logger.info("vbout getcontacts response body: {}".format(responseJSON))
+        self.logResponse('addcontact', response)
 
-        if('data' in responseJSON and 'items' in responseJSON['data']['contacts']):
-            if(responseJSON['data']['contacts']['count'] >= self.vboutApiLimit):
-                print("ERROR there might be more contacts that the API has not returned, check the limit parameter supplied")
-                self.all_success = False # response is not in the expected structure
-                self.emailBody = self.emailBody + 'Received contacts count is equal to the limit parameter supplied to the getcontacts request, so script might have not received all VBout contacts. Check the limit parameter used. \nVbout getcontacts request url: ' + url + ' \nReceived response: ' +  response.text
-            else:
-                contactsList = responseJSON['data']['contacts']['items']
-                for eachUser in contactsList:
-                    self.vboutContacts[eachUser['email']] = eachUser
-                self.logger.info("vbout getcontacts response headers: {}".format(response.headers))
+        if('header' in responseJSON and 'status' in responseJSON['header'] and responseJSON['header']['status'] == 'ok'):
+            self.logger.info("addcontact %s SUCCESS", userEmail)
+            print('--SUCCESS addcontact ', userEmail)
+            with self.reportLock:
+                self.successfullyAddedUsers = self.successfullyAddedUsers + userEmail + '\n'
+            return True
         else:
-            self.all_success = False # response is not in the expected structure
-            self.emailBody = self.emailBody + 'Response received from VBout getcontacts request is not in the expected format. \nVbout getcontacts request url: ' + url + ' \nReceived response: ' +  response.text + ' \nExpected a "data" and then a "contacts" attribute'
+            self.logger.warning("addcontact %s ERROR: %s", userEmail, str(responseJSON.get('data'))[:self.logBodyLimit])
+            print('--ERROR addcontact ', userEmail)
+            self.reportError('Failed to add a contact to VBout. \nVbout addcontact request url: ' + redactUrl(response.url) + ' \nReceived response: ' +  response.text[:self.logBodyLimit] + '\n') # mark the error in the email
+            return False
 
-    # Add Contacts to VBout
-    def addVboutContact(self, userEmail, userDetails, listID):
+    # Update the changed fields of a VBout contact
+    def updateVboutContact(self, userEmail, contactID, changedFields, listID):
         '''
-        Add a contact to the Vbout List with the received id
-        Expected userDetails parameter format: {'user@company.com': {'firstName': 'User', 'lastName': 'User', 'group': 'oktaGroup1'}, 'user.second@acy.com': {'firstName': 'User', 'lastName': 'Second', 'group': 'oktaGroupX'}, ... }
+        Update only the changed fields of a contact in the Vbout List with the received id
+        Expected changedFields parameter format: {'lastName': 'Second', 'group': 'oktaGroupX'}
 
-        addcontact endpoint:  POST https://api.vbout.com/1/emailmarketing/addcontact.json?key={YOUR_API_ID} email=info@example.com status=active listid=24 fields[125]=John fields[1204]=Doe fields[325]=1983-9-1
-        '''  
+        updatecontact endpoint:  POST https://api.vbout.com/1/emailmarketing/updatecontact.json?key={YOUR_API_ID} id=14523 email=info@example.com listid=24 fields[1204]=Doe
+        '''
+        fieldIDs = {'firstName': self.vboutFirstNameFieldID, 'lastName': self.vboutLastNameFieldID, 'group': self.vboutCustomerFieldID, 'created': self.vboutActivatedFieldID}
+        url = self.vboutUrl + "emailmarketing/updatecontact.json"
+        params = {'key': self.vboutApiKey, 'id': str(contactID), 'email': userEmail, 'listid': listID}
+        for attribute, value in changedFields.items():
+            params['fields[' + str(fieldIDs[attribute]) + ']'] = value # Encoded by requests, so "&", "#" or "+" in a value cannot break the request
 
-        url = self.vboutUrl + "emailmarketing/addcontact.json?key=" + self.vboutApiKey + '&email=' + userEmail + '&status=active&listid=' + listID + '&fields[' + str(self.vboutFirstNameFieldID) + ']=' + userDetails['firstName'] +'&fields[' + str(self.vboutLastNameFieldID) + ']=' + userDetails['lastName'] + '&fields[' + str(self.vboutCustomerFieldID) + ']=' + userDetails['group'] + '&fields[' + str(self.vboutActivatedFieldID) + ']=' + userDetails['created'] + '&fields[' + str(self.vboutEmailFieldID) + ']=' + userEmail
-        print('addUser url',url)
-        self.logger.info("vbout addcontact request url: {}".format(url))
-        
         payload = ""
         headers = {
             'Accept': "application/json",
             'Content-Type': "application/json"
             }
 
-        response = requests.request("POST", url, data=payload, headers=headers)
+        response = self.session.request("POST", url, data=payload, headers=headers, params=params)
         responseJSON = json.loads(response.text)['response']
-        self.logger.info("vbout addcontact {} response body: {}".format(userEmail, responseJSON))
+        self.logResponse('updatecontact', response)
 
         if('header' in responseJSON and 'status' in responseJSON['header'] and responseJSON['header']['status'] == 'ok'):
-            self.logger.info("addcontact {} SUCCESS: {}".format(userEmail, responseJSON['data']))
-            print('--SUCCESS addcontact ', userEmail)
-            self.successfullyAddedUsers = self.successfullyAddedUsers + userEmail + '\n'
+            self.logger.info("updatecontact %s SUCCESS", userEmail)
+            print('--SUCCESS updatecontact ', userEmail)
+            with self.reportLock:
+                self.successfullyUpdatedUsers = self.successfullyUpdatedUsers + userEmail + ' (' + ', '.join(changedFields) + ')\n'
+            return True
         else:
-            self.logger.info("addcontact {} ERROR: {}".format(userEmail, responseJSON['data']))
-            print('--ERROR addcontact ', userEmail)
-            self.all_success = False # mark the error in the email
-            self.emailBody = self.emailBody + 'Failed to add a contact to VBout. \nVbout addcontact request url: ' + url + ' \nReceived response: ' +  response.text
+            self.logger.warning("updatecontact %s ERROR: %s", userEmail, str(responseJSON.get('data'))[:self.logBodyLimit])
+            print('--ERROR updatecontact ', userEmail)
+            self.reportError('Failed to update a contact on VBout. \nVbout updatecontact request url: ' + redactUrl(response.url) + ' \nReceived response: ' +  response.text[:self.logBodyLimit] + '\n') # mark the error in the email
+            return False
 
     def deleteVboutContact(self, userEmail, contactID, listID):
         '''
@@ -256,7 +996,6 @@ class oktaVboutSync():
         '''  
 
         url = self.vboutUrl + "emailmarketing/deletecontact.json?key=" + self.vboutApiKey + '&id=' + contactID + '&listid=' + listID
-        self.logger.info("vbout deletecontact request url: {}".format(url))
         
         payload = ""
         headers = {
@@ -264,76 +1003,229 @@ class oktaVboutSync():
             'Content-Type': "application/json"
             }
 
-        response = requests.request("POST", url, data=payload, headers=headers)
+        response = self.session.request("POST", url, data=payload, headers=headers)
         responseJSON = json.loads(response.text)['response']
-        self.logger.info("vbout deletecontact response body: {}".format(responseJSON))
+        self.logResponse('deletecontact', response)
 
         if('header' in responseJSON and 'status' in responseJSON['header'] and responseJSON['header']['status'] == 'ok'):
-            self.logger.info("deletecontact {} SUCCESS: {}".format(userEmail, responseJSON['data']))
+            self.logger.info("deletecontact %s SUCCESS", userEmail)
             print('--SUCCESS deletecontact ', userEmail)
-            self.successfullyDeletedUsers = self.successfullyDeletedUsers + userEmail + '\n'
+            with self.reportLock:
+                self.successfullyDeletedUsers = self.successfullyDeletedUsers + userEmail + '\n'
+            return True
         else:
-            self.logger.info("deletecontact {} ERROR: {}".format(userEmail, responseJSON['data']))
+            self.logger.warning("deletecontact %s ERROR: %s", userEmail, str(responseJSON.get('data'))[:self.logBodyLimit])
             print('--ERROR deletecontact ', userEmail)
-            self.all_success = False # mark the error in the email
-            self.emailBody = self.emailBody +'Failed to delete a contact from VBout. \nVbout deletecontact request url: ' + url + ' \nReceived response: ' +  response.text
+            self.reportError('Failed to delete a contact from VBout. \nVbout deletecontact request url: ' + redactUrl(url) + ' \nReceived response: ' +  response.text[:self.logBodyLimit] + '\n') # mark the error in the email
+            return False
+
+    # Compare Okta users with VBout contacts
+    def planVboutChanges(self):
+        '''
+        Field level diff of "oktaUsers" against "vboutContacts". Returns the minimal list of operations for applyVboutWrites():
+        - add:    users active on Okta that are not in the VBout list
+        - update: users in both, with only the fields (firstName, lastName, group, created) whose value differs. Unchanged contacts get no operation at all
+        - delete: contacts in the VBout list that do not exist (or are not active anymore) on Okta
+        Deletes are left out if any Okta request failed and adds are left out if any VBout page could not be read, so missing data never causes a write.
+        Nothing is planned if the synced list was not found on VBout
+        '''
+        operations = []
+        if not self.vboutOktaListID:
+            return operations
+        if self.oktaComplete:
+            for userEmail in sorted(set(self.vboutContacts) - set(self.oktaUsers)):
+                operations.append(('delete', userEmail, self.vboutContacts[userEmail]['id']))
+        for userEmail in sorted(self.oktaUsers):
+            userDetails = self.oktaUsers[userEmail]
+            contact = self.vboutContacts.get(userEmail)
+            if contact is None:
+                if self.vboutComplete:
+                    operations.append(('add', userEmail, userDetails.toDict()))
+                continue
+            changedFields = {attribute: userDetails[attribute] for attribute in ('firstName', 'lastName', 'group', 'created') if attribute in contact and contact[attribute] != userDetails[attribute]}
+            if changedFields:
+                operations.append(('update', userEmail, {'id': contact['id'], 'fields': changedFields}))
+        return operations
+
+    # Save the planned VBout changes
+    def writePlan(self, operations):
+        '''
+        Write the operations returned by planVboutChanges() to "planFile" as JSON Lines, so they can be reviewed (dry run) and applied later without repeating any Okta/VBout reads.
+        First line holds what the apply phase needs besides the operations, every other line is one operation:
+        {"listID": "97396", "fieldIDs": {"firstName": "125", ...}, "allSuccess": true, "errors": ""}
+        {"n": 0, "op": "delete", "email": "user@company.com", "data": "14523"}
+        {"n": 1, "op": "update", "email": "user.third@acy.com", "data": {"id": "14524", "fields": {"group": "oktaGroupY"}}}
+        '''
+        header = {'listID': self.vboutOktaListID,
+                  'fieldIDs': {'firstName': self.vboutFirstNameFieldID, 'lastName': self.vboutLastNameFieldID, 'email': self.vboutEmailFieldID, 'group': self.vboutCustomerFieldID, 'created': self.vboutActivatedFieldID},
+                  'allSuccess': self.all_success, 'errors': self.emailBody}
+        with open(self.planFile, 'w', encoding='utf-8') as planFile:
+            planFile.write(json.dumps(header) + '\n')
+            for n, (action, userEmail, data) in enumerate(operations):
+                planFile.write(json.dumps({'n': n, 'op': action, 'email': userEmail, 'data': data}) + '\n')
+        if os.path.exists(self.planFile + '.done'):
+            os.remove(self.planFile + '.done') # Progress of the previous plan does not apply to the new one
+        self.logger.info("Wrote plan with %s operations to %s", len(operations), self.planFile)
+
+    # Apply the planned VBout changes
+    def applyPlan(self):
+        '''
+        Read "planFile" and run the operations that are not recorded in planFile + ".done" yet through applyVboutWrites().
+        Every successful operation is appended to the .done file as soon as it finishes, so re-running apply after a crash only sends the remaining (and failed) operations
+        '''
+        with open(self.planFile, encoding='utf-8') as planFile:
+            header = json.loads(planFile.readline())
+            plannedOperations = [json.loads(line) for line in planFile if line.strip()]
+
+        self.vboutOktaListID = header['listID']
+        self.vboutFirstNameFieldID = header['fieldIDs']['firstName']
+        self.vboutLastNameFieldID = header['fieldIDs']['lastName']
+        self.vboutEmailFieldID = header['fieldIDs']['email']
+        self.vboutCustomerFieldID = header['fieldIDs']['group']
+        self.vboutActivatedFieldID = header['fieldIDs']['created']
+        self.all_success = header['allSuccess'] # Errors received while planning are still reported in the email of the apply phase
+        self.emailBody = header['errors']
+
+        done = set()
+        if os.path.exists(self.planFile + '.done'):
+            with open(self.planFile + '.done', encoding='utf-8') as doneFile:
+                done = {int(line) for line in doneFile if line.strip()}
+        operations = [(operation['op'], operation['email'], operation['data'], operation['n']) for operation in plannedOperations if operation['n'] not in done]
+        print("Applying {} of {} planned operations ({} already applied)".format(len(operations), len(plannedOperations), len(plannedOperations) - len(operations)))
+
+        doneLock = threading.Lock()
+        with open(self.planFile + '.done', 'a', encoding='utf-8') as doneFile:
+            def markDone(operation):
+                with doneLock:
+                    doneFile.write(str(operation[3]) + '\n')
+                    doneFile.flush()
+            self.applyVboutWrites(operations, onSucceeded=markDone)
+
+    # Send queued VBout writes through a pool of workers
+    def applyVboutWrites(self, operations, onSucceeded=None):
+        '''
+        Run the received add/delete operations on the synced VBout list using "vboutWriteWorkers" worker threads sharing the same session.
+        VBout has no bulk add/update/delete contact endpoint, so each operation is still one request, but up to "vboutWriteWorkers" of them are in flight at a time.
+        The outcome of every operation is counted in "vboutWriteCounts" for the status email, and onSucceeded(operation) is called (from the worker thread) for every operation that succeeded
+
+        Expected operations parameter format: [('delete', 'user@company.com', '14523'), ('add', 'user.second@acy.com', {'firstName': 'User', 'lastName': 'Second', 'created': '2023-01-01', 'group': 'oktaGroupX'}),
+                                               ('update', 'user.third@acy.com', {'id': '14524', 'fields': {'group': 'oktaGroupY'}}), ...]
+        '''
+        def runOperation(operation):
+            action, userEmail, data = operation[:3]
+            try:
+                if action == 'add':
+                    succeeded = self.addVboutContact(userEmail, data, self.vboutOktaListID)
+                elif action == 'update':
+                    succeeded = self.updateVboutContact(userEmail, data['id'], data['fields'], self.vboutOktaListID)
+                else:
+                    succeeded = self.deleteVboutContact(userEmail, data, self.vboutOktaListID)
+            except Exception as e: # Keep the other workers going if a single request fails (e.g. connection error or a response that is not JSON)
+                self.logger.exception("%s %s failed", action, userEmail)
+                self.reportError('Failed to ' + action + ' VBout contact ' + userEmail + ': ' + repr(e) + '\n')
+                succeeded = False
+            with self.reportLock:
+                self.vboutWriteCounts[action]['succeeded' if succeeded else 'failed'] += 1
+            if succeeded and onSucceeded:
+                onSucceeded(operation)
+
+        with ThreadPoolExecutor(max_workers=max(self.vboutWriteWorkers, 1)) as executor:
+            list(executor.map(runOperation, operations)) # list() waits for all operations to finish
+        if self.cache and operations:
+            self.cache.invalidate('getcontacts') # Cached contacts do not include the changes just made
+
     
-    def send_email(self):
+    # Status report of the run
+    def report(self):
+        '''
+        Body of the status email: errors received, users added/updated/deleted, the number of successful/failed writes and the request, cache and run metrics
+        '''
+        writeSummary = ', '.join('{} {} ({} failed)'.format(action, counts['succeeded'], counts['failed']) for action, counts in self.vboutWriteCounts.items())
+        return self.emailBody + self.successfullyAddedUsers + '\n' + self.successfullyUpdatedUsers + '\n' + self.successfullyDeletedUsers + '\n' + 'VBout contacts: ' + writeSummary + '\n' + self.oktaScheduler.summary() + (self.cache.summary() if self.cache else '') + '\n' + self.metrics.summary()
+
+    def send_email(self, emailSubject=None, emailBody=None):
+        '''
+        Send the status email, by default the report() of this run. multiTenantSync.py sends one email combining the reports of all mappings
+        '''
         print("\n\nSending email")
         
-        if self.all_success:
-            emailSubject = "Vbout-Okta SYNC - Success"
+        if emailSubject is None:
+            emailSubject = "Vbout-Okta SYNC - Success" if self.all_success else "Vbout-Okta SYNC - ERROR"
+        if emailBody is None:
+            emailBody = self.report()
+        message = 'Subject: {}\n\n{}'.format(emailSubject, emailBody)
+        self.logger.info("Sending email: %s", message) 
+        if self.smtpSsl:
+            server = smtplib.SMTP_SSL(self.smtpHost, self.smtpPort, context=ssl.create_default_context())
         else:
-            emailSubject = "Vbout-Okta SYNC - ERROR"
-        self.emailBody = self.emailBody + self.successfullyAddedUsers + '\n' + self.successfullyDeletedUsers
-        message = 'Subject: {}\n\n{}'.format(emailSubject, self.emailBody)
-        self.logger.info("Sending email: {}".format(message)) 
-        context = ssl.create_default_context()
-        with smtplib.SMTP_SSL(self.smtpHost, self.smtpPort, context=context) as server:
+            server = smtplib.SMTP(self.smtpHost, self.smtpPort)
+        with server:
             server.login(self.smtpUser, self.smtpPassword)
             server.sendmail(self.smtpUser, self.recipients, message)
 
     
 if __name__ == '__main__' :
-    def syncOktaAndVbout():
-        deleteDict = set(sync.vboutContacts) - set(sync.oktaUsers) # emails of users (derived from the keys of the dictionaries) in VBout that do not exist (or not active anymore) on Okta
-        print("\n\n--to be deleted from vbout (total {})".format(len(deleteDict)))
+    # "python oktaVboutSync.py plan" only reads Okta/VBout and writes the planned changes to planFile (dry run),
+    # "python oktaVboutSync.py apply" applies (or resumes applying) the last plan, without arguments both phases are run
+    mode = sys.argv[1] if len(sys.argv) > 1 and sys.argv[1] in ('plan', 'apply') else 'sync'
 
-        addDict = set(sync.oktaUsers) - set(sync.vboutContacts) # emails of active users (derived from the keys of the dictionaries) on Okta that do not exist in VBout
-        print("\n++to be added from vbout (total {})".format(len(addDict)))
-    
-        for deleteUser in deleteDict:
-            print('delete from vbout',deleteUser,sync.vboutContacts[deleteUser]['id'])
-            sync.deleteVboutContact(deleteUser, sync.vboutContacts[deleteUser]['id'], sync.vboutOktaListID)
-    
-        for addUser in addDict:
-            sync.addVboutContact(addUser, sync.oktaUsers[addUser], sync.vboutOktaListID)
+    def syncOktaAndVbout():
+        operations = sync.planVboutChanges()
+        for action in ('delete', 'update', 'add'):
+            print("\n{} in vbout (total {})".format(action, sum(1 for operation in operations if operation[0] == action)))
+        sync.writePlan(operations)
 
     def deleteAllVBoutContacts():
         deleteDict = set(sync.vboutContacts)
         print("\n--DELETE ALL CONTACTS IN VBOUT {} LIST".format(sync.vboutListToSync))
-        for deleteUser in deleteDict:
-            print('delete from vbout',deleteUser,sync.vboutContacts[deleteUser]['id'])
-            sync.deleteVboutContact(deleteUser, sync.vboutContacts[deleteUser]['id'], sync.vboutOktaListID)
+        sync.writePlan([('delete', deleteUser, sync.vboutContacts[deleteUser]['id']) for deleteUser in deleteDict])
 
     sync = oktaVboutSync()
-    sync.listGroups() # Get Okta groups, store in "groups" attribute
 
-    for group in sync.groups:
+    if mode != 'apply': # Plan phase
+        syncStart = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.000Z') # Saved in the checkpoint, the next incremental run fetches changes made after this time
+        checkpoint = None
+        if sync.syncMode == 'incremental' and '--full' not in sys.argv: # Run "python oktaVboutSync.py --full" to run a full sync and reset the checkpoint
+            checkpoint = sync.loadCheckpoint()
+
+        with sync.metrics.phase('oktaGroups'):
+            sync.listGroups() # Get Okta groups, store in "groups" attribute
+
         internalGroups = sync.excludedGroups.split(",")
-        if((group['name'] not in internalGroups)):     # Do not print internal test groups or groups that are used for functionality permissioning purposes
-            print("Getting members of Okta group: {}".format(group['name']))
-            sync.getOktaGroupMembers(group['name'], group['id'])
+        includedGroups = [group for group in sync.groups if group['name'] not in internalGroups] # Do not print internal test groups or groups that are used for functionality permissioning purposes
+        with sync.metrics.phase('oktaMembers'):
+            if checkpoint:
+                print("Getting Okta users changed since the last sync on {}".format(checkpoint['lastSync']))
+                sync.getIncrementalOktaChanges(checkpoint, includedGroups)
+            else:
+                print("Getting members of {} Okta groups, {} at a time".format(len(includedGroups), sync.oktaConcurrency))
+                sync.getAllOktaGroupMembers(includedGroups)
 
-    sync.getVboutLists()
-    
-    print("\nOkta Users (total of {})".format(len(sync.oktaUsers)))
-    print("\nVBout Contacts (total of {})",len(sync.vboutContacts))
+        with sync.metrics.phase('vboutReads'):
+            sync.getVboutLists()
+
+        print("\nOkta Users (total of {})".format(len(sync.oktaUsers)))
+        print("\nVBout Contacts (total of {})",len(sync.vboutContacts))
+
+        with sync.metrics.phase('plan'):
+            # PLAN THE SYNC OF OKTA ACCOUNTS & VBOUT CONTACTS (COMMENT OUT syncOktaAndVbout() IF YOU WANT TO DELETE ALL VBOUT OKTA ACCOUNTS CONTACTS TO START FROM SCRATCH)
+            syncOktaAndVbout()
+
+            # UNCOMMENT FUNCTION BELOW (AND COMMENT THE syncOktaAndVbout CALL ABOVE) TO PLAN THE DELETION OF ALL USERS ON VBOUT OKTA ACCONUTS LIST
+            #deleteAllVBoutContacts()
 
-    # SYNCH OKTA ACCOUNTS & VBOUT CONTACTS (COMMENT OUT syncOktaAndVbout() IF YOU WANT TO DELETE ALL VBOUT OKTA ACCOUNTS CONTACTS TO START FROM SCRATCH)
-    syncOktaAndVbout()
+            if sync.oktaComplete: # Do not save a checkpoint built from incomplete Okta data
+                sync.saveCheckpoint(syncStart)
 
-    # UNCOMMENT FUNCTION BELOW (AND COMMENT THE syncOktaAndVbout CALL ABOVE) TO DELETE ALL USERS ON VBOUT OKTA ACCONUTS LIST
-    #deleteAllVBoutContacts()
+    if mode == 'plan':
+        print("\nPlan written to {}, run \"python oktaVboutSync.py apply\" to apply it".format(sync.planFile))
+        if not sync.all_success:
+            print(sync.emailBody)
+    else: # Apply phase
+        with sync.metrics.phase('vboutWrites'):
+            sync.applyPlan()
+        with sync.metrics.phase('email'):
+            sync.send_email()
 
-    sync.send_email()
\ No newline at end of file
+    if sync.metricsFile:
+        sync.metrics.export(sync.metricsFile, sync.metricsFormat)
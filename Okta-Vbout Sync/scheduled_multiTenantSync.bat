@@ -0,0 +1,4 @@
+call D:\Users\{user}\AppData\Local\Continuum\anaconda3\Scripts\activate.bat
+cd "D:\Users\{user}\Documents\Coding\Python\Okta-Vbout Sync"
+python multiTenantSync.py
+exit
\ No newline at end of file